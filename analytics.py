@@ -0,0 +1,231 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from cache_backend import Cache, MemoryBackend
+
+# --- 投資組合績效計算 (不依賴 Streamlit) ---
+# 以 (投資組合 × 代碼) 的權重矩陣對共用的日報酬矩陣做矩陣乘法，一次算出所有組合的指標。
+
+RISK_FREE_RATE = 0.02
+TRADING_DAYS = 252
+METRIC_COLUMNS = ["total_return", "annual_return", "annual_volatility", "sharpe_ratio", "max_drawdown", "beta"]
+
+
+@dataclass(frozen=True)
+class PortfolioMetrics:
+    total_return: float
+    annual_return: float
+    annual_volatility: float
+    sharpe_ratio: float
+    max_drawdown: float
+    beta: float
+
+
+@dataclass(frozen=True)
+class PortfolioAnalysis:
+    tickers: tuple
+    weights: tuple
+    start_date: pd.Timestamp
+    end_date: pd.Timestamp
+    normalized_prices: pd.DataFrame
+    portfolio_returns: pd.Series
+    cumulative_returns: pd.Series
+    metrics: PortfolioMetrics
+
+    @property
+    def is_empty(self):
+        return self.portfolio_returns.empty
+
+
+@dataclass(frozen=True)
+class PortfolioTracking:
+    initial_investment: float
+    portfolio_value: pd.Series
+    current_allocations: pd.Series
+    current_value: float
+    today_change_value: float
+    today_change_percent: float
+    total_return_value: float
+    total_return_percent: float
+    shares: pd.Series = None
+
+
+def weight_matrix(portfolios, tickers):
+    """portfolios 為 [(tickers, weights), ...]，回傳列為組合、欄為 tickers 的權重矩陣。"""
+    column = {t: i for i, t in enumerate(tickers)}
+    matrix = np.zeros((len(portfolios), len(tickers)))
+    for row, (p_tickers, p_weights) in enumerate(portfolios):
+        for ticker, weight in zip(p_tickers, p_weights):
+            matrix[row, column[ticker]] += float(weight)
+    return pd.DataFrame(matrix, columns=list(tickers))
+
+
+def batch_portfolio_returns(prices, weights):
+    """回傳 (日期 × 組合) 的加權日報酬；組合中任一持股尚無報酬的日期為 NaN (等同單一組合時的 dropna)。"""
+    asset_returns = prices[weights.columns].ffill().pct_change(fill_method=None).to_numpy()
+    held = (weights.to_numpy() != 0).astype(float)
+    incomplete = np.isnan(asset_returns).astype(float) @ held.T > 0
+    portfolio_returns = np.nan_to_num(asset_returns) @ weights.to_numpy().T
+    portfolio_returns[incomplete] = np.nan
+    return pd.DataFrame(portfolio_returns, index=prices.index, columns=weights.index)
+
+
+def batch_metrics(portfolio_returns, benchmark_returns, years=None):
+    """依 batch_portfolio_returns 的結果計算每個組合的報酬、波動、夏普、最大回撤與 Beta。
+
+    years 未指定時，以每個組合實際有報酬資料的期間換算年化報酬。
+    """
+    r = portfolio_returns.to_numpy()
+    valid = ~np.isnan(r)
+    n = valid.sum(axis=0)
+    if years is None:
+        years = _years_covered(portfolio_returns.index, valid)
+
+    cumulative = np.where(valid, np.cumprod(1 + np.where(valid, r, 0.0), axis=0), np.nan)
+    total_return = np.array([cumulative[valid[:, j], j][-1] - 1 if n[j] else np.nan for j in range(r.shape[1])])
+    annual_volatility = _masked_std(r, valid) * np.sqrt(TRADING_DAYS)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        annual_return = (1 + total_return) ** (1 / years) - 1
+        sharpe_ratio = np.where(annual_volatility != 0, (annual_return - RISK_FREE_RATE) / annual_volatility, 0.0)
+    running_max = np.fmax.accumulate(cumulative, axis=0)
+    with np.errstate(invalid="ignore"):
+        drawdown = (cumulative - running_max) / running_max
+    max_drawdown = np.array([np.nanmin(drawdown[:, j]) if n[j] else np.nan for j in range(r.shape[1])])
+
+    b = benchmark_returns.reindex(portfolio_returns.index).to_numpy()[:, None]
+    common = valid & ~np.isnan(b)
+    n_common = common.sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r_mean = np.where(common, r, 0.0).sum(axis=0) / n_common
+        b_mean = np.where(common, b, 0.0).sum(axis=0) / n_common
+        covariance = np.where(common, (r - r_mean) * (b - b_mean), 0.0).sum(axis=0) / (n_common - 1)
+        variance = np.where(common, (b - b_mean) ** 2, 0.0).sum(axis=0) / (n_common - 1)
+        beta = covariance / variance
+
+    return pd.DataFrame({
+        "total_return": total_return, "annual_return": annual_return, "annual_volatility": annual_volatility,
+        "sharpe_ratio": sharpe_ratio, "max_drawdown": max_drawdown, "beta": beta,
+    }, index=portfolio_returns.columns, columns=METRIC_COLUMNS)
+
+
+def _masked_std(values, mask):
+    n = mask.sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.where(mask, values, 0.0).sum(axis=0) / n
+        return np.sqrt(np.where(mask, (values - mean) ** 2, 0.0).sum(axis=0) / (n - 1))
+
+
+def _years_covered(index, valid):
+    if not len(index):
+        return np.full(valid.shape[1], np.nan)
+    # 第一筆報酬的前一個交易日即為該組合價格資料的起點
+    first = np.maximum(valid.argmax(axis=0) - 1, 0)
+    last = len(index) - 1 - valid[::-1].argmax(axis=0)
+    days = np.asarray((index[last] - index[first]).days, dtype="float64")
+    return np.where(valid.any(axis=0) & (days > 0), days / 365.25, np.nan)
+
+
+def analyze_portfolios(prices, portfolios, benchmark="SPY"):
+    """一次分析多個組合，portfolios 為 [(tickers, weights), ...]，回傳對應的 PortfolioAnalysis 列表。"""
+    all_tickers = list(dict.fromkeys(t for p_tickers, _ in portfolios for t in p_tickers))
+    filled = prices.ffill()
+    weights = weight_matrix(portfolios, all_tickers)
+    portfolio_returns = batch_portfolio_returns(filled, weights)
+    metrics = batch_metrics(portfolio_returns, filled[benchmark].pct_change(fill_method=None))
+    analyses = []
+    for i, (p_tickers, p_weights) in enumerate(portfolios):
+        returns = portfolio_returns[i].dropna()
+        rec_data = filled[list(p_tickers)]
+        analyses.append(PortfolioAnalysis(
+            tickers=tuple(p_tickers), weights=tuple(p_weights),
+            start_date=rec_data.index[0] if len(rec_data) else None, end_date=rec_data.index[-1] if len(rec_data) else None,
+            # 以各代碼第一筆有效價格標準化，回測首日尚未上市的代碼不會變成整欄 NaN
+            normalized_prices=rec_data / rec_data.bfill().iloc[0] if len(rec_data) else rec_data,
+            portfolio_returns=returns, cumulative_returns=(1 + returns).cumprod(),
+            metrics=PortfolioMetrics(**metrics.loc[i].astype(float).to_dict()),
+        ))
+    return analyses
+
+
+def analyze_portfolio(prices, tickers, weights, benchmark="SPY"):
+    return analyze_portfolios(prices, [(tickers, weights)], benchmark)[0]
+
+
+def track_portfolio(prices, tickers, weights, initial_investment=10000.0):
+    """以推薦日起的收盤價計算假設初始投資的每日價值與目前持股配置。"""
+    data = prices[list(tickers)]
+    initial_allocation = pd.Series(weights, index=tickers) * initial_investment
+    shares = initial_allocation / data.iloc[0]
+    return _tracking(initial_investment, (data * shares).sum(axis=1), shares, data.iloc[-1])
+
+
+def resume_tracking(portfolio_value, shares, last_prices, new_prices, initial_investment=10000.0):
+    """以已算好的價值序列與持股數 (績效快照) 接上之後的收盤價，只計算新的交易日。
+
+    new_prices 只含 portfolio_value 最後一天之後的日期；沒有新資料時以 last_prices 作為目前價格。
+    """
+    if len(new_prices):
+        data = new_prices[list(shares.index)]
+        portfolio_value = pd.concat([portfolio_value, (data * shares).sum(axis=1)])
+        last_prices = data.iloc[-1]
+    return _tracking(initial_investment, portfolio_value, shares, last_prices)
+
+
+def append_quote(tracking, quotes, timestamp):
+    """以最新報價更新 track_portfolio 的結果，不需要重新下載歷史資料。
+
+    quotes 為各代碼最新價格；timestamp 與最後一點同一天時覆蓋該點 (盤中更新)，否則新增一點。
+    缺少報價的代碼沿用上次的價格。
+    """
+    previous_prices = tracking.current_allocations / tracking.shares
+    prices = quotes.reindex(tracking.shares.index).astype(float).fillna(previous_prices)
+    day = pd.Timestamp(timestamp)
+    if day.tzinfo is not None:
+        day = day.tz_localize(None)
+    day = day.normalize()
+    history = tracking.portfolio_value[tracking.portfolio_value.index < day]
+    portfolio_value = pd.concat([history, pd.Series([float((prices * tracking.shares).sum())], index=[day])])
+    return _tracking(tracking.initial_investment, portfolio_value, tracking.shares, prices)
+
+
+def _tracking(initial_investment, portfolio_value, shares, latest_prices):
+    current_value = portfolio_value.iloc[-1]
+    previous_day_value = portfolio_value.iloc[-2] if len(portfolio_value) > 1 else initial_investment
+    today_change_value = current_value - previous_day_value
+    total_return_value = current_value - initial_investment
+    return PortfolioTracking(
+        initial_investment=initial_investment, portfolio_value=portfolio_value,
+        current_allocations=shares * latest_prices, current_value=current_value,
+        today_change_value=today_change_value,
+        today_change_percent=(today_change_value / previous_day_value) if previous_day_value != 0 else 0,
+        total_return_value=total_return_value, total_return_percent=total_return_value / initial_investment,
+        shares=shares,
+    )
+
+
+class AnalysisCache:
+    """以 (代碼, 權重, 計算日期) 為鍵的分析結果快取；一批請求中只重新計算缺少的組合。
+
+    cache 為 cache_backend.Cache，未指定時使用行程內的 LRU。
+    """
+
+    def __init__(self, maxsize=256, ttl=900, cache=None):
+        self.cache = cache if cache is not None else Cache("analysis", MemoryBackend(maxsize), ttl)
+
+    def get_many(self, portfolios, as_of, compute):
+        """portfolios 為 [(tickers, weights), ...]；compute 接收缺少的組合並回傳對應的 PortfolioAnalysis 列表。"""
+        keys = [(tuple(tickers), tuple(float(w) for w in weights), str(as_of)) for tickers, weights in portfolios]
+        results = {}
+        for key in dict.fromkeys(keys):
+            analysis = self.cache.get(key)
+            if analysis is not None:
+                results[key] = analysis
+        missing = list(dict.fromkeys(key for key in keys if key not in results))
+        if missing:
+            computed = compute([(list(tickers), list(weights)) for tickers, weights, _ in missing])
+            for key, analysis in zip(missing, computed):
+                results[key] = analysis
+                self.cache.set(key, analysis)
+        return [results[key] for key in keys]
@@ -1,27 +1,43 @@
 import streamlit as st
-import yfinance as yf
 import pandas as pd
-import plotly.express as px
 from dotenv import load_dotenv
 import os
 from datetime import datetime, timedelta, timezone
-import numpy as np
 import json
-import requests
-import time
 import base64
-from openai import AzureOpenAI
-from newsapi import NewsApiClient
+import threading
+from contextlib import closing
+from contextvars import copy_context
 
-# Firebase Admin SDK & Pyrebase
-import firebase_admin
-from firebase_admin import credentials, auth, firestore
-import pyrebase
+# .env 必須在載入下列模組與建立任何共用資源之前讀入
+load_dotenv()
+
+# plotly.express、yfinance、NewsAPI、Firebase Admin SDK 與 Pyrebase 都在第一個需要它們的頁面才載入，
+# 新的容器不必先付出這些 import 與連線的成本才能顯示登入頁、開戶指南或教育中心
+import analytics
+import cache_backend
+import charts
+import monte_carlo
+import rebalance
+import tracing
+from cache_backend import Cache
+from config import get_setting
+from data_access import RecommendationRepository
+from market_data import LatestQuotes, MarketDataBroker, MarketDataError, RateLimitedError
+from model_gateway import MODEL_AZURE, MODEL_GEMINI, ModelError, ModelGateway
+from news import SUMMARY_RETENTION, NewsPipeline
+from price_store import PriceStore, default_refresh_interval
+from prompts import RecommendationStream, build_recommendation_prompt, parse_recommendation
+from recommendation_cache import RecommendationCache
+from snapshots import SnapshotStore
 
 # --- 頁面設定 ---
 st.set_page_config(page_title="美股智能投顧", layout="wide")
 
-# --- Firebase 初始化 ---
+# --- Firebase 初始化 (第一次需要時才執行) ---
+def firebase_configured():
+    return bool(get_setting("FIREBASE_CREDS_BASE64", "firebase_credentials", "base64") and get_setting("FIREBASE_API_KEY", "firebase_config", "apiKey"))
+
 @st.cache_resource
 def initialize_firebase():
     try:
@@ -33,6 +49,9 @@ def initialize_firebase():
                 st.session_state.firebase_error = True
             return None, None
         
+        import firebase_admin
+        import pyrebase
+        from firebase_admin import credentials, firestore
         creds_json = base64.b64decode(creds_base64).decode("utf-8")
         firebase_creds_dict = json.loads(creds_json)
         cred = credentials.Certificate(firebase_creds_dict)
@@ -53,63 +72,175 @@ def initialize_firebase():
         st.error(f"Firebase 初始化失敗: {e}")
         return None, None
 
-db, pyrebase_auth = initialize_firebase()
+def get_db():
+    return initialize_firebase()[0]
+
+# --- 本地價格資料庫 (跨 session 共用，缺少的資料透過行情代理合併下載並限流) ---
+# 下載結果另存於共用快取 (CACHE_BACKEND)，多個副本之間不必各自向 Yahoo 查詢
+@st.cache_resource
+def get_market_data_broker():
+    return MarketDataBroker(cache=Cache("market_data", ttl=default_refresh_interval().total_seconds()))
+
+@st.cache_resource
+def get_price_store():
+    return PriceStore(downloader=get_market_data_broker().download)
+
+# --- 績效分析快取 (以 代碼、權重、計算日期 為鍵，所有頁面共用) ---
+@st.cache_resource
+def get_analysis_cache():
+    return analytics.AnalysisCache(cache=Cache("analysis", ttl=900, local_entries=256))
+
+def load_portfolio_analyses(portfolios):
+    def compute(missing):
+        end_date, start_date = datetime.now(), datetime.now() - timedelta(days=5*365)
+        all_tickers = list(dict.fromkeys(t for tickers, _ in missing for t in tickers))
+        data = get_price_store().get_closes(all_tickers + ['SPY'], start=start_date, end=end_date)
+        with tracing.span("analytics.analyze_portfolios", portfolios=len(missing), tickers=len(all_tickers)):
+            return analytics.analyze_portfolios(data, missing)
+    return get_analysis_cache().get_many(portfolios, datetime.now().date(), compute)
+
+def load_portfolio_analysis(tickers, weights):
+    return load_portfolio_analyses([(tickers, weights)])[0]
+
+@st.cache_data(ttl=900, show_spinner=False)
+def load_portfolio_tracking(tickers, weights, recommendation_date, as_of, rec_id=None):
+    """有績效快照時只取得快照最後一個交易日起的價格並計算新的幾天；還原權值變動或沒有快照時從推薦日重算。"""
+    snapshot = load_snapshots([rec_id]).get((tickers, tuple(float(w) for w in weights))) if rec_id else None
+    if snapshot is not None:
+        recent = get_price_store().get_closes(list(tickers), start=snapshot.last_day, end=datetime.now())
+        new_prices = snapshot.new_prices(recent)
+        if new_prices is not None:
+            with tracing.span("analytics.resume_tracking", tickers=len(tickers), days=len(new_prices)):
+                tracking = analytics.resume_tracking(snapshot.portfolio_value, snapshot.shares, snapshot.last_closes, new_prices)
+            return tracking, len(tracking.portfolio_value)
+    data = get_price_store().get_closes(list(tickers), start=recommendation_date, end=datetime.now())
+    with tracing.span("analytics.track_portfolio", tickers=len(tickers)):
+        return analytics.track_portfolio(data, list(tickers), list(weights)), len(data)
+
+# --- 績效快照 (每晚由 snapshots.py 產生，見 README) ---
+@st.cache_resource
+def get_snapshot_store():
+    db = get_db()
+    return SnapshotStore(db, cache=Cache("snapshots", ttl=3600, local_entries=1024)) if db else None
+
+def load_snapshots(rec_ids):
+    """回傳 {(tickers, weights): Snapshot}；沒有快照或無法連線 Firestore 時為空。"""
+    store = get_snapshot_store() if rec_ids else None
+    if store is None:
+        return {}
+    return {(s.tickers, s.weights): s for s in store.get_many(rec_ids).values()}
+
+@st.cache_resource
+def get_latest_quotes():
+    return LatestQuotes(get_market_data_broker().download, ttl=LIVE_REFRESH_SECONDS)
+
+def fetch_latest_quotes(tickers, max_age=None):
+    """回傳 (各代碼最新報價, 報價時間)；所有 session 共用 max_age 秒內下載過的報價，只為過期的代碼向 Yahoo 查詢。"""
+    with tracing.span("market_data.latest_quotes", tickers=len(tickers)):
+        data = get_latest_quotes().recent_closes(tickers, max_age)
+    data = data.dropna(how="all")
+    if data.empty:
+        raise MarketDataError("目前無法取得最新報價。")
+    return data.ffill().iloc[-1], data.index[-1]
+
+# --- 圖表快取 (降採樣結果與 Plotly 圖表，以輸入為鍵，所有 session 共用) ---
+@st.cache_resource
+def get_chart_cache():
+    return charts.ChartCache()
+
+def downsampled(name, data):
+    return get_chart_cache().get_or_build((name, charts.fingerprint(data)), lambda: charts.downsample(data))
 
 # --- AI & News API 函數 ---
-def get_gemini_recommendation(prompt):
-    api_key = os.getenv("GEMINI_API_KEY", st.secrets.get("GEMINI_API_KEY"))
-    if not api_key: st.error("找不到 GEMINI_API_KEY！"); return None
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-05-20:generateContent?key={api_key}"
-    headers = {'Content-Type': 'application/json'}
-    data = { "contents": [{"parts": [{"text": prompt}]}], "generationConfig": {"temperature": 0.5, "maxOutputTokens": 4096} }
-    max_retries, backoff_factor = 3, 1.0
-    for attempt in range(max_retries):
-        try:
-            response = requests.post(url, headers=headers, json=data, timeout=60)
-            response.raise_for_status()
-            result = response.json()
-            candidates = result.get("candidates")
-            if not candidates or not candidates[0].get("content") or not candidates[0]["content"].get("parts"): return None
-            return candidates[0]['content']['parts'][0]['text']
-        except requests.exceptions.RequestException:
-            if attempt < max_retries - 1: time.sleep(backoff_factor * (2 ** attempt))
-            else: return None
-    return None
-
-def get_azure_openai_recommendation(prompt):
+@st.cache_resource
+def get_model_gateway():
+    return ModelGateway()
+
+def stream_recommendation(model, prompt):
+    """串流顯示推薦理由，[START]…[END] 區塊一結束就停止接收並回傳目前的回覆文字；失敗時回傳 None。"""
+    placeholder = st.empty()
+    stream = RecommendationStream()
+    placeholder.caption(f"正在使用 {model} 為您分析中...")
     try:
-        client = AzureOpenAI(
-            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT", st.secrets["azure_openai"]["endpoint"]),
-            api_key=os.getenv("AZURE_OPENAI_API_KEY", st.secrets["azure_openai"]["api_key"]),
-            api_version=os.getenv("AZURE_OPENAI_API_VERSION", st.secrets["azure_openai"]["api_version"])
-        )
-        response = client.chat.completions.create(
-            model=os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", st.secrets["azure_openai"]["deployment_name"]),
-            messages=[{"role": "system", "content": "You are a professional financial advisor."}, {"role": "user", "content": prompt}],
-            temperature=0.5, max_tokens=1024,
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        st.error(f"呼叫 Azure OpenAI API 時發生錯誤: {e}")
+        with closing(get_model_gateway().stream(model, prompt)) as chunks:
+            for chunk in chunks:
+                if stream.feed(chunk):
+                    break
+                if stream.reason:
+                    placeholder.markdown(f"**推薦理由：** {stream.reason} ▌")
+    except ModelError as e:
+        placeholder.empty()
+        st.error(str(e))
         return None
+    except ValueError:
+        # 區塊格式不符，交給儲存流程以 parse_recommendation 顯示錯誤
+        pass
+    placeholder.empty()
+    return stream.text
+
+def prefetch_backtest_prices(tickers):
+    """在背景下載新建議回測所需的五年價格，與 Firestore 寫入同時進行；跳轉到儀表板後直接讀本地資料。"""
+    store = get_price_store()
+    end_date, start_date = datetime.now(), datetime.now() - timedelta(days=5*365)
+    def run():
+        try:
+            with tracing.span("price_store.prefetch", tickers=len(tickers)):
+                store.get_closes(list(tickers) + ['SPY'], start=start_date, end=end_date)
+        except Exception:
+            pass  # 預取失敗不影響流程，儀表板會再下載一次
+    threading.Thread(target=copy_context().run, args=(run,), name="backtest-prefetch", daemon=True).start()
+
+@st.cache_resource
+def get_recommendation_cache():
+    return RecommendationCache()
+
+def lookup_cached_recommendation(profile, selected_model):
+    cache = get_recommendation_cache()
+    if selected_model != MODEL_RACE:
+        return selected_model, cache.get(profile, selected_model)
+    # 競速模式：任一模型已有快取即可使用，查詢次數記在 Gemini 名下供預熱使用
+    for i, model in enumerate((MODEL_GEMINI, MODEL_AZURE)):
+        rec = cache.get(profile, model, record_request=(i == 0))
+        if rec: return model, rec
+    return selected_model, None
+
+def race_recommendations(prompt):
+    try:
+        with tracing.span("llm.race"):
+            model_used, response_content, parsed = get_model_gateway().race(prompt, parse_recommendation)
+        return model_used, response_content
+    except ModelError as e:
+        st.error(f"所有 AI 模型皆無法提供有效建議：{e}")
+        return None, None
         
-@st.cache_data(ttl=3600)
-def get_financial_news_summary(_tickers):
-    news_api_key = os.getenv("NEWS_API_KEY", st.secrets.get("NEWS_API_KEY"))
-    if not news_api_key:
+@st.cache_resource
+def get_news_pipeline():
+    news_api_key = get_setting("NEWS_API_KEY", "NEWS_API_KEY")
+    if not news_api_key: return None
+    from newsapi import NewsApiClient
+    newsapi = NewsApiClient(api_key=news_api_key)
+    gateway = get_model_gateway()
+    fetch_articles = lambda ticker: newsapi.get_everything(q=ticker, language='en', sort_by='relevancy', page_size=5)['articles']
+    def summarize(prompt):
+        # 也會在背景預取執行緒中呼叫，那裡沒有 Streamlit 畫面可顯示錯誤，失敗時只回傳 None
+        try: return gateway.call_gemini(prompt)
+        except ModelError: return None
+    pipeline = NewsPipeline(fetch_articles, summarize, article_cache=Cache("news_articles", ttl=3600), summary_cache=Cache("news_summaries", ttl=SUMMARY_RETENTION))
+    pipeline.start_prefetcher(interval=int(os.getenv("NEWS_PREFETCH_MINUTES", "60")) * 60)
+    return pipeline
+
+def prefetch_news_summary(tickers):
+    """新建議儲存後立即在背景抓新聞並產生摘要，跳轉到儀表板時多半已經算好。"""
+    pipeline = get_news_pipeline()
+    if pipeline is not None:
+        pipeline.prefetch(tickers)
+
+def get_financial_news_summary(tickers):
+    pipeline = get_news_pipeline()
+    if pipeline is None:
         return "警告：偵測不到 NewsAPI 金鑰，無法獲取財經新聞。"
     try:
-        newsapi = NewsApiClient(api_key=news_api_key)
-        query = " OR ".join(_tickers)
-        articles = newsapi.get_everything(q=query, language='en', sort_by='relevancy', page_size=5)['articles']
-        if not articles:
-            return "今天沒有您投資組合的相關重大新聞。"
-        news_content = ""
-        for article in articles:
-            news_content += f"Title: {article['title']}\nDescription: {article['description']}\n\n"
-        prompt = f"請扮演一位專業的財經分析師，用繁體中文為一位投資新手，總結以下關於他們投資組合 ({', '.join(_tickers)}) 的市場新聞。請識別潛在的正面或負面訊號，並以客觀、精簡的風格分析可能帶來的影響。請將最終總結控制在 200 字以內，並直接給出結論。\n\n新聞原文如下：\n{news_content}"
-        summary = get_gemini_recommendation(prompt)
-        return summary if summary else "AI 無法總結新聞，請稍後再試。"
+        return pipeline.get_summary(tickers)
     except Exception as e:
         return f"無法獲取財經新聞：{e}。請檢查 NewsAPI 金鑰或稍後再試。"
 
@@ -117,6 +248,21 @@ def get_financial_news_summary(_tickers):
 if 'page' not in st.session_state: st.session_state.page = '登入'
 if 'user' not in st.session_state: st.session_state.user = None
 
+# --- 推薦紀錄讀取快取 (每個 session 一份，新增紀錄時同步更新) ---
+def get_recommendation_repository():
+    user_id = st.session_state.user['uid']
+    repo = st.session_state.get('rec_repo')
+    if repo is None or repo.user_id != user_id:
+        if repo is not None: repo.close()
+        repo = RecommendationRepository(get_db(), user_id)
+        if os.getenv("FIRESTORE_LIVE_UPDATES") == "1": repo.watch()
+        st.session_state.rec_repo = repo
+    return repo
+
+def close_recommendation_repository():
+    repo = st.session_state.pop('rec_repo', None)
+    if repo is not None: repo.close()
+
 # --- 核心渲染函數 ---
 
 def render_sidebar():
@@ -139,12 +285,14 @@ def render_sidebar():
         if st.button("📚 投資教育中心", use_container_width=True): st.session_state.page = '教育'; st.rerun()
         if st.session_state.user:
             st.write("---")
+            if is_admin(st.session_state.user): st.toggle("🔍 顯示本次執行耗時分析", key="show_trace")
             if st.button("登出", use_container_width=True):
+                close_recommendation_repository()
                 st.session_state.user = None; st.session_state.page = '登入'; st.rerun()
 
 def page_login():
-    # 首先检查Firebase状态
-    if not db or not pyrebase_auth:
+    # 首先检查Firebase状态 (只檢查設定；連線在送出表單時才建立)
+    if not firebase_configured():
         st.title("歡迎使用美股智能投顧")
         st.error("Firebase 初始化失敗，無法提供登入服務。請聯繫管理員。")
         return
@@ -168,8 +316,10 @@ def page_login():
                     email, password = st.text_input("電子郵件"), st.text_input("密碼", type="password")
                     if st.form_submit_button("登入", use_container_width=True):
                         try:
+                            db, pyrebase_auth = initialize_firebase()
                             user = pyrebase_auth.sign_in_with_email_and_password(email, password)
-                            user_doc = db.collection("users").document(user['localId']).get()
+                            with tracing.span("firestore.query", op="user"):
+                                user_doc = db.collection("users").document(user['localId']).get()
                             st.session_state.user = user_doc.to_dict() if user_doc.exists else {'email': email, 'display_name': '用戶'}
                             st.session_state.user['uid'] = user['localId']
                             st.session_state.page = '儀表板'
@@ -181,6 +331,8 @@ def page_login():
                     if st.form_submit_button("註冊", use_container_width=True):
                         if not all([email, password, display_name]): st.warning("請填寫所有欄位。"); return
                         try:
+                            from firebase_admin import firestore
+                            db, pyrebase_auth = initialize_firebase()
                             user = pyrebase_auth.create_user_with_email_and_password(email, password)
                             db.collection("users").document(user['localId']).set({"email": email, "display_name": display_name, "created_at": firestore.SERVER_TIMESTAMP})
                             st.success("註冊成功！請前往登入頁面登入。")
@@ -189,13 +341,13 @@ def page_login():
 def page_dashboard():
     user_name = st.session_state.user.get('display_name', '訪客')
     st.title(f"📈 {user_name} 的個人儀表板")
+    if flash_message := st.session_state.pop('flash_message', None):
+        st.success(flash_message)
     st.write("---")
-    user_id = st.session_state.user['uid']
-    latest_rec_ref = db.collection("recommendations").where("user_id", "==", user_id).order_by("timestamp", direction=firestore.Query.DESCENDING).limit(1).stream()
-    latest_rec = next(latest_rec_ref, None)
+    latest_rec = get_recommendation_repository().latest()
     
     if latest_rec:
-        rec = latest_rec.to_dict()
+        rec = latest_rec[1]
         with st.container(border=True):
             st.subheader("📰 今日投資組合輿情分析")
             with st.spinner("正在為您分析相關財經新聞..."):
@@ -211,7 +363,7 @@ def page_dashboard():
             rec_time_tw = rec_time_utc.astimezone(tw_timezone).strftime("%Y-%m-%d %H:%M:%S")
             model_used = rec.get("model", "未知模型")
             st.info(f"- **推薦時間:** {rec_time_tw}\n- **分析模型:** {model_used}\n- **AI 推薦理由:** {rec['reason']}")
-            display_portfolio_performance(rec['tickers'], rec['weights'])
+            display_portfolio_performance(rec['tickers'], rec['weights'], recommendation_date=rec['timestamp'].date(), rec_id=latest_rec[0])
     else:
         st.info("您目前沒有任何 AI 推薦紀錄。")
         if st.button("🤖 點此獲取您的第一個客製化投資組合！", use_container_width=True):
@@ -220,56 +372,82 @@ def page_dashboard():
 def page_my_portfolio():
     st.title("💼 我的投資組合即時追蹤")
     st.write("---")
-    user_id = st.session_state.user['uid']
-    latest_rec_ref = db.collection("recommendations").where("user_id", "==", user_id).order_by("timestamp", direction=firestore.Query.DESCENDING).limit(1).stream()
-    latest_rec = next(latest_rec_ref, None)
+    latest_rec = get_recommendation_repository().latest()
     if not latest_rec:
         st.warning("您尚未產生任何 AI 投資建議。請先前往「產生新分析」頁面。")
         return
-    rec = latest_rec.to_dict()
+    rec_id, rec = latest_rec
     tickers, weights = rec['tickers'], rec['weights']
     recommendation_date = rec['timestamp'].date()
+    if st.toggle("📡 即時追蹤", key="live_tracking_enabled", help="開啟後只在下方區塊定時抓取最新報價並更新，不會重新下載歷史資料，也不會重新執行整個頁面。"):
+        options = sorted({15, 30, 60, 300, LIVE_REFRESH_SECONDS})
+        interval = st.select_slider("更新間隔 (秒)", options=options, value=LIVE_REFRESH_SECONDS, key="live_tracking_interval")
+        st.fragment(render_live_tracking, run_every=interval)(rec_id, tuple(tickers), tuple(weights), recommendation_date, interval)
+        return
+    st.session_state.pop('live_tracking', None)
     with st.spinner("正在獲取最新市場數據..."):
         try:
-            data = yf.download(tickers, start=recommendation_date, end=datetime.now(), auto_adjust=True)['Close']
-            if isinstance(data, pd.Series): data = data.to_frame(name=tickers[0])
-            
-            with st.container(border=True):
-                st.subheader("即時績效總覽")
-                initial_investment = 10000.0
-                initial_prices = data.iloc[0]
-                initial_allocation = pd.Series(weights, index=tickers) * initial_investment
-                shares = initial_allocation / initial_prices
-                portfolio_value = (data * shares).sum(axis=1)
-                current_value = portfolio_value.iloc[-1]
-                previous_day_value = portfolio_value.iloc[-2] if len(portfolio_value) > 1 else initial_investment
-                today_change_value = current_value - previous_day_value
-                today_change_percent = (today_change_value / previous_day_value) if previous_day_value != 0 else 0
-                total_return_value = current_value - initial_investment
-                total_return_percent = (total_return_value / initial_investment)
-                cols = st.columns(3)
-                cols[0].metric(label="目前總價值 (USD)", value=f"${current_value:,.2f}", delta=f"${today_change_value:,.2f} ({today_change_percent:.2%})", help="價值基於假設的 $10,000 初始投資計算。")
-                cols[1].metric(label="總報酬率", value=f"{total_return_percent:.2%}", delta=f"${total_return_value:,.2f}")
-                cols[2].metric(label="追蹤天數", value=f"{(datetime.now().date() - recommendation_date).days} 天")
-            
-            if len(data) < 2:
-                with st.container(border=True):
-                    st.subheader("價值增長曲線")
-                    st.info("📈 價值增長曲線將在下一個交易日後可用。")
-            else:
-                with st.container(border=True):
-                    st.subheader("價值增長曲線")
-                    fig = px.line(x=portfolio_value.index, y=portfolio_value, title="投資組合價值增長", labels={'x': '日期', 'y': '價值 (USD)'})
-                    st.plotly_chart(fig, use_container_width=True)
-            with st.container(border=True):
-                st.subheader("目前持股明細")
-                current_prices = data.iloc[-1]
-                current_allocations = shares * current_prices
-                breakdown_df = pd.DataFrame({"標的": tickers, "目前價值 (USD)": current_allocations, "目前佔比": (current_allocations / current_value)}).sort_values(by="目前價值 (USD)", ascending=False)
-                st.dataframe(breakdown_df.style.format({"目前價值 (USD)": "${:,.2f}", "目前佔比": "{:.2%}"}), use_container_width=True)
+            tracking, _ = load_portfolio_tracking(tuple(tickers), tuple(weights), recommendation_date, datetime.now().date(), rec_id)
+            render_tracking(tracking, tickers, recommendation_date)
         except Exception as e:
             st.error(f"獲取市場數據或計算績效時發生錯誤: {e}")
 
+# --- 即時追蹤 (st.fragment 定時重跑，只更新本區塊) ---
+# 第一次執行時載入歷史價值序列並存在 session_state，之後每次只取最新報價 (所有 session 共用，見 LatestQuotes)，
+# 最新報價與最後一點同一天時覆蓋、否則新增一點；日期改變或關閉後重新開啟時則重新載入歷史，中間的收盤價不會遺漏。
+LIVE_REFRESH_SECONDS = int(os.getenv("LIVE_REFRESH_SECONDS", "60"))
+
+def render_live_tracking(rec_id, tickers, weights, recommendation_date, interval=LIVE_REFRESH_SECONDS):
+    key = (rec_id, tickers, weights, datetime.now().date())
+    state = st.session_state.get('live_tracking')
+    if state is None or state['key'] != key:
+        try:
+            tracking, _ = load_portfolio_tracking(tickers, weights, recommendation_date, datetime.now().date(), rec_id)
+        except RateLimitedError as e:
+            st.warning(f"⚠️ {e}"); return
+        except Exception as e:
+            st.error(f"獲取市場數據或計算績效時發生錯誤: {e}"); return
+        state = st.session_state.live_tracking = {'key': key, 'tracking': tracking, 'updated_at': datetime.now()}
+    else:
+        try:
+            state['tracking'] = analytics.append_quote(state['tracking'], *fetch_latest_quotes(tickers, max_age=interval))
+            state['updated_at'] = datetime.now()
+        except MarketDataError as e:
+            st.caption(f"⚠️ 暫時無法更新報價，顯示上次的數據：{e}")
+    st.caption(f"最後更新：{state['updated_at']:%H:%M:%S}")
+    render_tracking(state['tracking'], tickers, recommendation_date, cache_chart=False)
+
+def render_tracking(tracking, tickers, recommendation_date, cache_chart=True):
+    with st.container(border=True):
+        st.subheader("即時績效總覽")
+        cols = st.columns(3)
+        cols[0].metric(label="目前總價值 (USD)", value=f"${tracking.current_value:,.2f}", delta=f"${tracking.today_change_value:,.2f} ({tracking.today_change_percent:.2%})", help="價值基於假設的 $10,000 初始投資計算。")
+        cols[1].metric(label="總報酬率", value=f"{tracking.total_return_percent:.2%}", delta=f"${tracking.total_return_value:,.2f}")
+        cols[2].metric(label="追蹤天數", value=f"{(datetime.now().date() - recommendation_date).days} 天")
+
+    if len(tracking.portfolio_value) < 2:
+        with st.container(border=True):
+            st.subheader("價值增長曲線")
+            st.info("📈 價值增長曲線將在下一個交易日後可用。")
+    else:
+        with st.container(border=True):
+            st.subheader("價值增長曲線")
+            portfolio_value = tracking.portfolio_value
+            def build_value_chart():
+                import plotly.express as px
+                values = charts.downsample(portfolio_value)
+                return px.line(x=values.index, y=values, title="投資組合價值增長", labels={'x': '日期', 'y': '價值 (USD)'})
+            # 即時模式每次最後一點都不同，直接建圖，不佔用共用的圖表快取
+            fig = get_chart_cache().get_or_build(("value", charts.fingerprint(portfolio_value)), build_value_chart) if cache_chart else build_value_chart()
+            st.plotly_chart(fig, use_container_width=True)
+    with st.container(border=True):
+        st.subheader("目前持股明細")
+        current_allocations = tracking.current_allocations
+        breakdown_df = pd.DataFrame({"標的": list(tickers), "目前價值 (USD)": current_allocations, "目前佔比": (current_allocations / tracking.current_value)}).sort_values(by="目前價值 (USD)", ascending=False)
+        st.dataframe(breakdown_df.style.format({"目前價值 (USD)": "${:,.2f}", "目前佔比": "{:.2%}"}), use_container_width=True)
+
+MODEL_RACE = "⚡ 同時詢問兩個模型 (採用最快的有效回覆)"
+
 def page_new_analysis():
     st.title("🤖 產生新的 AI 投資建議")
     with st.form("analysis_form"):
@@ -288,45 +466,76 @@ def page_new_analysis():
         risk_tolerance = st.selectbox("風險偏好", risk_tolerances)
         investment_experiences = ["無經驗", "1年以下", "1-3年", "3年以上"]
         investment_experience = st.selectbox("投資經驗", investment_experiences)
-        selected_model = st.selectbox("請選擇 AI 分析模型:", ("Google Gemini 2.5 Flash", "Azure OpenAI (GPT-4o mini)"))
+        selected_model = st.selectbox("請選擇 AI 分析模型:", (MODEL_GEMINI, MODEL_AZURE, MODEL_RACE))
+        use_cache = st.checkbox("相同條件直接使用先前的分析結果", value=True, help="取消勾選可強制請 AI 重新分析。")
         submitted = st.form_submit_button("🚀 開始分析", use_container_width=True)
     if submitted:
-        prompt = f"使用者資料:\n- 職業: {profession}, - 月薪範圍: {monthly_salary} (台幣), - 負債範圍: {debt} (台幣)\n- 年齡範圍: {age_range}, - 風險偏好: {risk_tolerance}, - 投資經驗: {investment_experience}\n\n請根據以上資料，為一位投資新手推薦3到5個美國市場的投資標的（股票或ETF），並嚴格按照以下格式回覆:\n[START]\n推薦理由: [繁體中文，不超過150字]\n股票代碼: [例如：VOO,AAPL,MSFT]\n投資比例: [例如：0.6,0.2,0.2]\n[END]"
-        with st.spinner(f"正在使用 {selected_model} 為您分析中..."):
-            response_content = get_gemini_recommendation(prompt) if selected_model == "Google Gemini 2.5 Flash" else get_azure_openai_recommendation(prompt)
-        if response_content:
-            st.session_state.page = '儀表板'
+        profile = {"profession": profession, "monthly_salary": monthly_salary, "debt": debt, "age_range": age_range, "risk_tolerance": risk_tolerance, "investment_experience": investment_experience}
+        rec, model_used, response_content = None, selected_model, None
+        if use_cache:
+            model_used, rec = lookup_cached_recommendation(profile, selected_model)
+        if rec is None:
+            prompt = build_recommendation_prompt(**profile)
+            if selected_model == MODEL_RACE:
+                with st.spinner(f"正在使用 {selected_model} 為您分析中..."):
+                    model_used, response_content = race_recommendations(prompt)
+            else:
+                model_used = selected_model
+                response_content = stream_recommendation(selected_model, prompt)
+        if rec or response_content:
             try:
-                content = response_content.split("[START]")[1].split("[END]")[0].strip()
-                lines = content.split('\n')
-                reason, tickers, weights = lines[0].replace("推薦理由: ", ""), [t.strip() for t in lines[1].replace("股票代碼: ", "").split(",")], [float(w) for w in lines[2].replace("投資比例: ", "").split(",")]
-                rec_data = {"user_id": st.session_state.user['uid'], "timestamp": firestore.SERVER_TIMESTAMP, "tickers": tickers, "weights": weights, "reason": reason, "model": selected_model}
-                db.collection("recommendations").add(rec_data)
-                st.success("分析完成並已儲存！將為您跳轉至儀表板。")
-                time.sleep(2)
+                if rec is None:
+                    rec = parse_recommendation(response_content)
+                    get_recommendation_cache().put(profile, model_used, rec)
+                prefetch_backtest_prices(rec['tickers'])
+                from firebase_admin import firestore
+                rec_data = {"user_id": st.session_state.user['uid'], "timestamp": firestore.SERVER_TIMESTAMP, "tickers": rec['tickers'], "weights": rec['weights'], "reason": rec['reason'], "model": model_used}
+                get_recommendation_repository().add(rec_data)
             except Exception as e:
                 st.error(f"儲存紀錄時失敗：{e}")
+                return
+            prefetch_news_summary(rec['tickers'])
+            # 訊息留到儀表板顯示，不必停在這頁等待
+            st.session_state.flash_message = "分析完成並已儲存！"
+            st.session_state.page = '儀表板'
             st.rerun()
 
+HISTORY_PAGE_SIZE = 10
+
 def page_history():
     st.title("📂 所有歷史推薦紀錄")
-    recs_ref = db.collection("recommendations").where("user_id", "==", st.session_state.user['uid']).order_by("timestamp", direction=firestore.Query.DESCENDING).stream()
-    user_recs = list(recs_ref)
+    repo = get_recommendation_repository()
+    user_recs, has_more = repo.loaded()
+    if not user_recs and has_more:
+        repo.load_more(HISTORY_PAGE_SIZE)
+        user_recs, has_more = repo.loaded()
     if not user_recs:
         st.info("您目前沒有任何歷史推薦紀錄。")
     else:
+        # 每筆先顯示摘要；只有使用者展開的紀錄才計算績效，並共用一次價格下載
+        expanded = [(rec_id, rec) for rec_id, rec in user_recs if st.session_state.get(f"perf_{rec_id}")]
+        analyses = {}
+        if expanded:
+            with st.spinner("正在獲取歷史市場數據..."):
+                try:
+                    analyses = dict(zip([rec_id for rec_id, _ in expanded], load_portfolio_analyses([(rec['tickers'], rec['weights']) for _, rec in expanded])))
+                except RateLimitedError as e:
+                    st.warning(f"⚠️ {e}")
         tw_timezone = timezone(timedelta(hours=8))
-        for rec_doc in user_recs:
-            rec = rec_doc.to_dict()
+        for rec_id, rec in user_recs:
             with st.container(border=True):
                 rec_time_utc = rec['timestamp']
                 if rec_time_utc.tzinfo is None: rec_time_utc = rec_time_utc.replace(tzinfo=timezone.utc)
                 rec_time_tw = rec_time_utc.astimezone(tw_timezone).strftime("%Y-%m-%d %H:%M:%S")
                 model_used = rec.get("model", "未知模型")
                 st.subheader(f"{rec_time_tw} 的推薦 (by {model_used})")
-                st.caption(f"標的: `{', '.join(rec['tickers'])}`")
+                st.caption("配置: " + " · ".join(f"`{t}` {w:.0%}" for t, w in zip(rec['tickers'], rec['weights'])))
                 st.info(f"**當時的推薦理由：** {rec['reason']}")
-                display_portfolio_performance(rec['tickers'], rec['weights'], is_historical=True)
+                if st.toggle("📊 顯示歷史績效與風險分析", key=f"perf_{rec_id}"):
+                    display_portfolio_performance(rec['tickers'], rec['weights'], is_historical=True, analysis=analyses.get(rec_id), key=rec_id)
+        if has_more and st.button("⬇️ 載入更早的紀錄", use_container_width=True):
+            repo.load_more(HISTORY_PAGE_SIZE)
+            st.rerun()
 
 def page_open_account():
     # <-- 修正 1: 恢復完整內容 -->
@@ -415,7 +624,11 @@ def page_education_center():
         3.  **現金流量表 (Cash Flow Statement)**: 追蹤公司**現金的流入與流出**，反映真實的營運健康狀況。
         """)
 
-def display_portfolio_performance(tickers, weights, is_historical=False):
+def display_portfolio_performance(tickers, weights, is_historical=False, analysis=None, key=None, recommendation_date=None, rec_id=None):
+    with tracing.span("render.performance", tickers=len(tickers)):
+        _display_portfolio_performance(tickers, weights, is_historical, analysis, key, recommendation_date, rec_id)
+
+def _display_portfolio_performance(tickers, weights, is_historical, analysis, key, recommendation_date, rec_id):
     with st.container(border=True):
         st.write("#### 投資組合配置")
         portfolio_df = pd.DataFrame({'投資標的': tickers, '投資比例': weights})
@@ -423,84 +636,178 @@ def display_portfolio_performance(tickers, weights, is_historical=False):
         with col1:
             st.dataframe(portfolio_df.assign(投資比例=lambda df: df['投資比例'].map('{:.0%}'.format)), hide_index=True)
         with col2:
-            fig_pie = px.pie(portfolio_df, values='投資比例', names='投資標的', title='投資組合佔比圖')
+            def build_pie():
+                import plotly.express as px
+                return px.pie(portfolio_df, values='投資比例', names='投資標的', title='投資組合佔比圖')
+            fig_pie = get_chart_cache().get_or_build(("pie", tuple(tickers), tuple(weights)), build_pie)
             st.plotly_chart(fig_pie, use_container_width=True)
     
     with st.spinner("正在獲取歷史市場數據..."):
         try:
-            end_date, start_date = datetime.now(), datetime.now() - timedelta(days=5*365)
-            data = yf.download(tickers + ['SPY'], start=start_date, end=end_date, auto_adjust=True)["Close"]
-            if data.empty or data[tickers].isnull().all().all(): st.warning("⚠️ 找不到有效的歷史數據。"); return
-            rec_data, spy_data = data[tickers].ffill(), data[['SPY']].ffill()
+            if analysis is None:
+                analysis = load_portfolio_analysis(tickers, weights)
+            if analysis.is_empty: st.warning("⚠️ 找不到有效的歷史數據。"); return
+            metrics = analysis.metrics
             with st.container(border=True):
-                st.subheader(f"歷史績效回測 (回測區間: {start_date.strftime('%Y-%m-%d')} ~ {end_date.strftime('%Y-%m-%d')})")
+                st.subheader(f"歷史績效回測 (回測區間: {analysis.start_date.strftime('%Y-%m-%d')} ~ {analysis.end_date.strftime('%Y-%m-%d')})")
                 
                 st.write("##### 價格走勢 (標準化)")
-                normalized_data = rec_data / rec_data.iloc[0]
-                st.line_chart(normalized_data)
+                # 約 5 年、每檔 1,250 個交易日，降採樣後每張圖只傳送約 500 個點
+                st.line_chart(downsampled("normalized", analysis.normalized_prices))
                 
                 st.write("##### 累積報酬率")
-                cumulative_returns = (1 + (rec_data.pct_change().dropna() * weights).sum(axis=1)).cumprod()
-                st.area_chart(cumulative_returns)
+                st.area_chart(downsampled("cumulative", analysis.cumulative_returns))
             
             with st.container(border=True):
-                total_return, annual_return = cumulative_returns.iloc[-1] - 1, (1 + cumulative_returns.iloc[-1] - 1) ** (1/5) - 1
-                annual_volatility = (rec_data.pct_change().dropna() * weights).sum(axis=1).std() * np.sqrt(252)
-                sharpe_ratio = (annual_return - 0.02) / annual_volatility if annual_volatility != 0 else 0
-                max_drawdown = ((cumulative_returns - cumulative_returns.cummax()) / cumulative_returns.cummax()).min()
-                spy_returns = spy_data.pct_change().dropna()['SPY']
-                common_index = (rec_data.pct_change().dropna() * weights).sum(axis=1).index.intersection(spy_returns.index)
-                beta = (rec_data.pct_change().dropna() * weights).sum(axis=1)[common_index].cov(spy_returns[common_index]) / spy_returns[common_index].var()
                 st.subheader("📊 績效總覽")
                 cols = st.columns(3)
-                cols[0].metric("期間總報酬率", f"{total_return:.2%}")
-                cols[1].metric("年化報酬率", f"{annual_return:.2%}")
-                cols[2].metric("年化波動率", f"{annual_volatility:.2%}")
+                cols[0].metric("期間總報酬率", f"{metrics.total_return:.2%}")
+                cols[1].metric("年化報酬率", f"{metrics.annual_return:.2%}")
+                cols[2].metric("年化波動率", f"{metrics.annual_volatility:.2%}")
                 cols = st.columns(3)
-                cols[0].metric("夏普比率 (Sharpe)", f"{sharpe_ratio:.2f}")
-                cols[1].metric("最大回撤 (Max Drawdown)", f"{max_drawdown:.2%}", help="從最高點到最低點的最大損失幅度。")
-                cols[2].metric("Beta (β) vs S&P 500", f"{beta:.2f}", help="相對於大盤的波動性。")
+                cols[0].metric("夏普比率 (Sharpe)", f"{metrics.sharpe_ratio:.2f}")
+                cols[1].metric("最大回撤 (Max Drawdown)", f"{metrics.max_drawdown:.2%}", help="從最高點到最低點的最大損失幅度。")
+                cols[2].metric("Beta (β) vs S&P 500", f"{metrics.beta:.2f}", help="相對於大盤的波動性。")
             
             with st.container(border=True):
                 if not is_historical:
                     with st.expander("🎲 查看未來10年投資組合風險預測 (蒙地卡羅模擬)"):
-                        run_monte_carlo_simulation((rec_data.pct_change().dropna() * weights).sum(axis=1))
-                else:
-                    st.subheader("🎲 未來10年投資組合風險預測 (蒙地卡羅模擬)")
-                    run_monte_carlo_simulation((rec_data.pct_change().dropna() * weights).sum(axis=1))
+                        run_monte_carlo_simulation(analysis.portfolio_returns, key=key)
+                # 歷史頁面一次列出多筆推薦，模擬改為使用者開啟後才執行
+                elif st.toggle("🎲 執行未來10年投資組合風險預測 (蒙地卡羅模擬)", key=f"mc_{key}"):
+                    run_monte_carlo_simulation(analysis.portfolio_returns, key=key)
+
+            if len(tickers) > 1:
+                with st.container(border=True):
+                    if not is_historical:
+                        with st.expander("⚖️ 權重試算與再平衡建議"):
+                            render_what_if(analysis, tickers, weights, key=key, recommendation_date=recommendation_date, rec_id=rec_id)
+                    elif st.toggle("⚖️ 權重試算 (效率前緣)", key=f"whatif_{key}"):
+                        render_what_if(analysis, tickers, weights, key=key)
         except Exception as e:
             st.error(f"⚠️ 數據處理或圖表生成失敗: {e}")
 
-def run_monte_carlo_simulation(portfolio_returns):
-    with st.spinner("正在執行 1,000 次未來路徑模擬..."):
-        n_simulations, years, initial_investment = 1000, 10, 10000
-        mean_return, std_dev = portfolio_returns.mean(), portfolio_returns.std()
-        simulated_returns = np.random.normal(mean_return, std_dev, (252 * years, n_simulations))
-        final_values = initial_investment * (1 + pd.DataFrame(simulated_returns)).cumprod().iloc[-1]
+MONTE_CARLO_METHODS = {"對數常態 (快速)": "lognormal", "常態分布 (逐日)": "normal", "歷史重抽樣 (Bootstrap)": "bootstrap", "區塊重抽樣 (Block Bootstrap)": "block_bootstrap"}
+MONTE_CARLO_PATHS = [1000, 10000, 100000, 200000]
+# 逐日抽樣 (normal / bootstrap) 的耗時與 路徑數 × 天數 成正比，20 萬條路徑要 7 到 16 秒，只開放到一萬條
+MONTE_CARLO_DAILY_MAX_PATHS = 10000
+
+def run_monte_carlo_simulation(portfolio_returns, key=None):
+    cols = st.columns(2)
+    method_label = cols[1].selectbox("抽樣方法", list(MONTE_CARLO_METHODS), key=f"mc_method_{key}")
+    options = MONTE_CARLO_PATHS
+    if MONTE_CARLO_METHODS[method_label] in ("normal", "bootstrap"):
+        options = [n for n in MONTE_CARLO_PATHS if n <= MONTE_CARLO_DAILY_MAX_PATHS]
+    paths_key = f"mc_paths_{key}"
+    if st.session_state.get(paths_key) not in options:
+        st.session_state[paths_key] = min(10000, options[-1])
+    n_simulations = cols[0].select_slider("模擬路徑數", options=options, format_func="{:,}".format, key=paths_key)
+    with st.spinner(f"正在執行 {n_simulations:,} 次未來路徑模擬..."):
+        years, initial_investment, method = 10, 10000, MONTE_CARLO_METHODS[method_label]
+        def simulate():
+            with tracing.span("monte_carlo.simulate", paths=n_simulations, method=method):
+                result = monte_carlo.simulate_final_values(portfolio_returns, n_paths=n_simulations, years=years, initial_investment=initial_investment, method=method)
+            # 只保留分位數與直方圖，不把原始模擬值送到瀏覽器
+            summary = charts.distribution_summary(result.final_values)
+            return summary, charts.distribution_figure(summary, title="基於過去5年數據模擬一萬美元投資十年後的價值分佈")
+        summary, fig = get_chart_cache().get_or_build(("monte_carlo", method, n_simulations, years, initial_investment, charts.fingerprint(portfolio_returns)), simulate)
         st.subheader("十年後投資價值分佈預測")
-        st.plotly_chart(px.box(y=final_values, points="all", title=f"基於過去5年數據模擬一萬美元投資十年後的價值分佈"), use_container_width=True)
-        percentiles = np.percentile(final_values, [5, 50, 95])
-        median_value_str, lower_bound_str, upper_bound_str = f"${percentiles[1]:,.0f}", f"${percentiles[0]:,.0f}", f"${percentiles[2]:,.0f}"
+        st.plotly_chart(fig, use_container_width=True)
+        percentiles = summary.percentiles
+        median_value_str, lower_bound_str, upper_bound_str = f"${percentiles[50]:,.0f}", f"${percentiles[5]:,.0f}", f"${percentiles[95]:,.0f}"
         st.markdown(f"- **中位數價值 (50% 機率)**: 10 年後，您的 ${initial_investment:,.0f} 投資，有 50% 的機率會成長到 **{median_value_str}** 美元以上。\n- **90% 信心區間**: 我們有 90% 的信心，10 年後的投資價值會落在 **{lower_bound_str}** 美元至 **{upper_bound_str}** 美元之間。")
-        st.info("**解讀**: 此模擬基於過去5年的歷史波動性與回報率，推算上千種可能的未來路徑。")
+        st.info(f"**解讀**: 此模擬基於過去5年的歷史波動性與回報率，推算 {n_simulations:,} 種可能的未來路徑。")
+
+# --- 權重試算與再平衡 ---
+def render_what_if(analysis, tickers, weights, key=None, recommendation_date=None, rec_id=None):
+    n_candidates = st.select_slider("候選權重組數", options=[1000, 10000, 50000], value=rebalance.DEFAULT_CANDIDATES, format_func="{:,}".format, key=f"whatif_n_{key}")
+    def evaluate():
+        with tracing.span("rebalance.what_if", candidates=n_candidates, tickers=len(tickers)):
+            result = rebalance.what_if(analysis.normalized_prices, tickers, weights, n_candidates)
+        return result, charts.frontier_figure(result)
+    try:
+        result, fig = get_chart_cache().get_or_build(("what_if", tuple(tickers), tuple(weights), n_candidates, charts.fingerprint(analysis.normalized_prices)), evaluate)
+    except ValueError as e:
+        st.warning(f"⚠️ {e}"); return
+    st.plotly_chart(fig, use_container_width=True)
+    points = {"目前建議": result.target, "最小變異": result.min_variance, "最大夏普": result.max_sharpe}
+    rows = []
+    for name, index in points.items():
+        point = result.point(index)
+        rows.append({"組合": name, **point['weights'].map('{:.0%}'.format).to_dict(), "期望年化報酬": f"{point['expected_return']:.2%}", "年化波動": f"{point['volatility']:.2%}", "夏普": f"{point['sharpe_ratio']:.2f}"})
+    st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
+    st.caption(f"以過去回測期間的平均報酬與共變異數，一次評估 {len(result.volatilities):,} 組僅做多、總和為 100% 的權重；歷史表現不代表未來結果。")
+    if recommendation_date is None:
+        return
+    st.write("##### 目前配置與目標的偏離")
+    try:
+        tracking, _ = load_portfolio_tracking(tuple(tickers), tuple(weights), recommendation_date, datetime.now().date(), rec_id)
+    except Exception as e:
+        st.caption(f"⚠️ 無法取得目前配置：{e}"); return
+    drift_df = rebalance.drift(tickers, weights, tracking.current_allocations)
+    drift_df = drift_df.rename(columns={'target_weight': '目標比例', 'current_weight': '目前比例', 'drift': '偏離', 'current_value': '目前價值 (USD)', 'trade_value': '再平衡買賣 (USD)'})
+    st.dataframe(drift_df.style.format({'目標比例': '{:.1%}', '目前比例': '{:.1%}', '偏離': '{:+.1%}', '目前價值 (USD)': '${:,.2f}', '再平衡買賣 (USD)': '${:+,.2f}'}), use_container_width=True)
+    st.caption("以推薦當日假設投入 $10,000 計算；正值為需買進、負值為需賣出的金額。")
+
+# --- 效能追蹤 ---
+@st.cache_resource
+def start_metrics_endpoint():
+    tracing.configure_logging()
+    port = os.getenv("METRICS_PORT")
+    return tracing.start_metrics_server(int(port)) if port else None
+
+def is_admin(user):
+    admins = get_setting("ADMIN_EMAILS", "admin", "emails", default="")
+    if isinstance(admins, str): admins = admins.split(",")
+    admins = {a.strip().lower() for a in admins if a.strip()}
+    return bool(user) and (user.get('email') or '').lower() in admins
+
+def render_trace_panel(trace):
+    import plotly.express as px
+    data = trace.to_dict()
+    with st.expander(f"🔍 本次執行耗時分析 (至目前為止 {data['duration_ms']:,.0f} ms)", expanded=True):
+        if data['spans']:
+            spans_df = pd.DataFrame(data['spans'])
+            spans_df['階段'] = ['　' * depth + name for depth, name in zip(spans_df['depth'], spans_df['name'])]
+            fig = px.bar(spans_df, x='duration_ms', y='階段', base='start_ms', orientation='h', labels={'duration_ms': '耗時 (ms)', '階段': ''}, title="各階段時間軸")
+            fig.update_yaxes(autorange="reversed")
+            st.plotly_chart(fig, use_container_width=True)
+            tag_columns = [c for c in spans_df.columns if c not in ('name', 'depth', '階段', 'start_ms', 'duration_ms')]
+            st.dataframe(spans_df[['階段', 'start_ms', 'duration_ms'] + tag_columns].rename(columns={'start_ms': '開始 (ms)', 'duration_ms': '耗時 (ms)'}), hide_index=True, use_container_width=True)
+        else:
+            st.caption("本次執行沒有外部呼叫或計算階段 (全部命中快取)。")
+        st.write("##### 本行程累計 (所有使用者，毫秒)")
+        summary = pd.DataFrame(tracing.histogram_summary()).T
+        st.dataframe((summary[['mean', 'p50', 'p95', 'p99']].astype(float) * 1000).round(1).assign(count=summary['count'].astype(int)), use_container_width=True)
+        st.write("##### 共用快取 (本行程累計)")
+        cache_stats = pd.DataFrame(cache_backend.all_stats())
+        if not cache_stats.empty:
+            st.dataframe(cache_stats.rename(columns={'namespace': '命名空間', 'backend': '後端', 'hits': '命中', 'misses': '未命中', 'hit_rate': '命中率', 'local_hits': '本機命中', 'sets': '寫入', 'errors': '錯誤', 'evictions': '淘汰'}), hide_index=True, use_container_width=True)
 
 # --- 主應用程式路由 ---
-load_dotenv()
-render_sidebar()
-
-if 'firebase_error' in st.session_state:
-    st.error("應用程式因 Firebase 設定錯誤而無法啟動。")
-elif st.session_state.page == '登入':
-    page_login()
-elif st.session_state.page == '儀表板':
-    page_dashboard()
-elif st.session_state.page == '我的投資組合':
-    page_my_portfolio()
-elif st.session_state.page == '新分析':
-    page_new_analysis()
-elif st.session_state.page == '歷史紀錄':
-    page_history()
-elif st.session_state.page == '開戶':
-    page_open_account()
-elif st.session_state.page == '教育':
-    page_education_center()
\ No newline at end of file
+start_metrics_endpoint()
+trace = tracing.start_trace(page=st.session_state.page, user=(st.session_state.user or {}).get('uid'))
+try:
+    render_sidebar()
+
+    if 'firebase_error' in st.session_state:
+        st.error("應用程式因 Firebase 設定錯誤而無法啟動。")
+    elif st.session_state.page == '登入':
+        page_login()
+    elif st.session_state.page == '儀表板':
+        page_dashboard()
+    elif st.session_state.page == '我的投資組合':
+        page_my_portfolio()
+    elif st.session_state.page == '新分析':
+        page_new_analysis()
+    elif st.session_state.page == '歷史紀錄':
+        page_history()
+    elif st.session_state.page == '開戶':
+        page_open_account()
+    elif st.session_state.page == '教育':
+        page_education_center()
+
+    if st.session_state.get('show_trace') and is_admin(st.session_state.user):
+        render_trace_panel(trace)
+finally:
+    tracing.finish_trace(trace)
\ No newline at end of file
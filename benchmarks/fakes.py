@@ -0,0 +1,255 @@
+import base64
+import json
+import time
+import zlib
+from datetime import datetime, timezone
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# --- 離線替身 ---
+# 取代 yfinance、Firestore、Pyrebase、NewsAPI 與兩個 LLM 的本地實作，讓效能測試不需網路。
+# 價格為以代碼為種子的幾何布朗運動，同一代碼每次產生的數列都相同。
+
+TICKER_UNIVERSE = ["VOO", "QQQ", "VT", "AAPL", "MSFT", "NVDA", "GOOGL", "AMZN", "META", "TSLA", "BND", "VNQ", "SCHD", "VXUS", "JPM", "KO", "PG", "XOM", "UNH", "AVGO"]
+FIXTURE_START = "2010-01-01"
+
+
+# --- 價格 ---
+@lru_cache(maxsize=None)
+def _full_series(ticker):
+    rng = np.random.default_rng(zlib.crc32(ticker.encode("utf-8")))
+    full_index = pd.bdate_range(FIXTURE_START, pd.Timestamp.today().normalize())
+    returns = rng.normal(0.0004, 0.012, len(full_index))
+    return pd.Series(100 * np.exp(np.cumsum(returns)), index=full_index)
+
+
+def synthetic_closes(ticker, index):
+    return _full_series(ticker).reindex(index)
+
+
+class FakeYFinance:
+    """取代 yf.download，回傳與 yfinance 相同的 (Price, Ticker) 雙層欄位格式。"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = []
+
+    def download(self, tickers, start=None, end=None, **kwargs):
+        tickers = [tickers] if isinstance(tickers, str) else list(tickers)
+        self.calls.append((tuple(tickers), start, end))
+        time.sleep(self.latency)
+        end = pd.Timestamp(end) if end is not None else pd.Timestamp.today() + pd.Timedelta(days=1)
+        index = pd.bdate_range(pd.Timestamp(start).normalize(), end - pd.Timedelta(microseconds=1))
+        closes = pd.DataFrame({t: synthetic_closes(t, index) for t in tickers}, index=index)
+        closes.columns = pd.MultiIndex.from_product([["Close"], tickers], names=["Price", "Ticker"])
+        return closes
+
+
+# --- Firestore ---
+class FakeDocumentSnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class FakeDocumentReference:
+    def __init__(self, collection, doc_id):
+        self._collection = collection
+        self.id = doc_id
+
+    def get(self):
+        self._collection.db.reads += 1
+        return FakeDocumentSnapshot(self.id, self._collection.docs.get(self.id))
+
+    def set(self, data):
+        self._collection.db.writes += 1
+        self._collection.docs[self.id] = self._collection.db.resolve(data)
+
+
+class FakeQuery:
+    def __init__(self, collection, filters=(), order=None, limit=None, after=None):
+        self._collection = collection
+        self._filters = filters
+        self._order = order
+        self._limit = limit
+        self._after = after
+
+    def where(self, field, op, value):
+        assert op == "==", "替身只支援 == 條件"
+        return FakeQuery(self._collection, self._filters + ((field, value),), self._order, self._limit, self._after)
+
+    def order_by(self, field, direction="ASCENDING"):
+        return FakeQuery(self._collection, self._filters, (field, direction), self._limit, self._after)
+
+    def limit(self, count):
+        return FakeQuery(self._collection, self._filters, self._order, count, self._after)
+
+    def start_after(self, snapshot):
+        return FakeQuery(self._collection, self._filters, self._order, self._limit, snapshot.id)
+
+    def stream(self):
+        docs = [(doc_id, data) for doc_id, data in self._collection.docs.items() if all(data.get(f) == v for f, v in self._filters)]
+        if self._order:
+            field, direction = self._order
+            docs.sort(key=lambda item: item[1][field], reverse=str(direction).upper().endswith("DESCENDING"))
+        if self._after is not None:
+            ids = [doc_id for doc_id, _ in docs]
+            docs = docs[ids.index(self._after) + 1:] if self._after in ids else []
+        if self._limit is not None:
+            docs = docs[:self._limit]
+        for doc_id, data in docs:
+            self._collection.db.reads += 1
+            yield FakeDocumentSnapshot(doc_id, data)
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, db, name):
+        super().__init__(self)
+        self.db = db
+        self.name = name
+        self.docs = {}
+        self._auto_ids = 0
+
+    def document(self, doc_id=None):
+        # 與 Firestore 相同，建立參照時就決定 ID；同一批次中的多個新文件不會撞號
+        if doc_id is None:
+            self._auto_ids += 1
+            doc_id = f"{self.name}-{self._auto_ids:06d}"
+        return FakeDocumentReference(self, doc_id)
+
+    def add(self, data):
+        ref = self.document()
+        ref.set(data)
+        return datetime.now(timezone.utc), ref
+
+
+class FakeWriteBatch:
+    def __init__(self, db):
+        self.db = db
+        self._writes = []
+
+    def set(self, ref, data):
+        self._writes.append((ref, data))
+
+    def commit(self):
+        assert len(self._writes) <= 500, "Firestore 批次最多 500 筆寫入"
+        self.db.batch_commits += 1
+        for ref, data in self._writes:
+            ref.set(data)
+        self._writes = []
+
+
+class FakeFirestore:
+    def __init__(self):
+        self.collections = {}
+        self.reads = 0
+        self.writes = 0
+        self.batch_commits = 0
+
+    def collection(self, name):
+        if name not in self.collections:
+            self.collections[name] = FakeCollection(self, name)
+        return self.collections[name]
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def resolve(self, data):
+        # firestore.SERVER_TIMESTAMP 等哨兵值以目前時間取代
+        now = datetime.now(timezone.utc)
+        return {k: now if type(v).__name__ == "Sentinel" else v for k, v in data.items()}
+
+    def seed_recommendations(self, user_id, count, tickers_per_portfolio=4, seed=0):
+        rng = np.random.default_rng(seed)
+        collection = self.collection("recommendations")
+        for i in range(count):
+            tickers = [str(t) for t in rng.choice(TICKER_UNIVERSE, size=tickers_per_portfolio, replace=False)]
+            weights = rng.dirichlet(np.ones(tickers_per_portfolio)).round(2)
+            weights[-1] = round(1 - weights[:-1].sum(), 2)
+            collection.docs[f"rec-{i:06d}"] = {
+                "user_id": user_id, "timestamp": datetime(2024, 1, 1, tzinfo=timezone.utc) + pd.Timedelta(days=7 * i),
+                "tickers": tickers, "weights": [float(w) for w in weights], "reason": "離線測試用推薦。", "model": "Google Gemini 2.5 Flash",
+            }
+
+
+class FakePyrebaseAuth:
+    def sign_in_with_email_and_password(self, email, password):
+        return {"localId": "bench-user", "email": email}
+
+    def create_user_with_email_and_password(self, email, password):
+        return {"localId": "bench-user", "email": email}
+
+
+class FakePyrebaseApp:
+    def auth(self):
+        return FakePyrebaseAuth()
+
+
+# --- NewsAPI 與 LLM ---
+class FakeNewsApiClient:
+    def __init__(self, api_key=None, latency=0.0):
+        self.latency = latency
+
+    def get_everything(self, q=None, **kwargs):
+        time.sleep(self.latency)
+        return {"articles": [{"title": f"{q} headline {i}", "description": f"Synthetic article {i} about {q}.", "url": f"https://example.com/{q}/{i}"} for i in range(kwargs.get("page_size", 5))]}
+
+
+def fake_llm_response(prompt, latency=0.0):
+    time.sleep(latency)
+    rng = np.random.default_rng(zlib.crc32(prompt.encode("utf-8")))
+    tickers = [str(t) for t in rng.choice(TICKER_UNIVERSE, size=3, replace=False)]
+    if "[START]" not in prompt:
+        return "離線測試用新聞摘要。"
+    return f"[START]\n推薦理由: 離線測試用推薦理由。\n股票代碼: {','.join(tickers)}\n投資比例: 0.5,0.3,0.2\n[END]"
+
+
+PROFILE_OPTIONS = {
+    "profession": ["辦公室職員", "服務業", "製造業", "學生"], "monthly_salary": ["2萬-4萬", "4萬-6萬", "8萬以上"],
+    "debt": ["無負債", "10萬以下"], "age_range": ["20-30歲", "30-40歲", "50歲以上"],
+    "risk_tolerance": ["保守型", "均衡型", "積極型"], "investment_experience": ["無經驗", "1-3年"],
+}
+
+
+def fake_profiles(count, user_id="bench-user", seed=0):
+    """批次產生建議用的使用者條件 (與問卷選項同格式)，條件組合有限，會有重複。"""
+    rng = np.random.default_rng(seed)
+    return [{"user_id": user_id, **{field: str(rng.choice(options)) for field, options in PROFILE_OPTIONS.items()}} for _ in range(count)]
+
+
+def fake_llm_stream(prompt, latency=0.0, chunk_chars=16):
+    """與 fake_llm_response 相同的內容，分段產生；latency 平均分配到各段。"""
+    text = fake_llm_response(prompt)
+    chunks = [text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars)]
+    for chunk in chunks:
+        time.sleep(latency / len(chunks))
+        yield chunk
+
+
+def _fake_creds_base64():
+    creds = {"project_id": "bench-project", "type": "service_account"}
+    return base64.b64encode(json.dumps(creds).encode("utf-8")).decode("ascii")
+
+
+def fake_firebase_env():
+    return {
+        "FIREBASE_CREDS_BASE64": _fake_creds_base64(),
+        "FIREBASE_API_KEY": "bench-key", "GEMINI_API_KEY": "bench-key", "NEWS_API_KEY": "bench-key",
+        "AZURE_OPENAI_ENDPOINT": "https://bench.invalid", "AZURE_OPENAI_API_KEY": "bench-key",
+        "AZURE_OPENAI_API_VERSION": "2024-01-01", "AZURE_OPENAI_DEPLOYMENT_NAME": "bench",
+    }
+
+
+def fake_secrets():
+    """與 secrets.toml 相同結構的設定；app.py 在讀環境變數前會先存取 st.secrets，不能留空。"""
+    return {
+        "firebase_credentials": {"base64": _fake_creds_base64()}, "firebase_config": {"apiKey": "bench-key"},
+        "GEMINI_API_KEY": "bench-key", "NEWS_API_KEY": "bench-key",
+        "azure_openai": {"endpoint": "https://bench.invalid", "api_key": "bench-key", "api_version": "2024-01-01", "deployment_name": "bench"},
+    }
@@ -0,0 +1,254 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timezone
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+import analytics
+import monte_carlo
+import rebalance
+import snapshots
+from benchmarks import fakes
+from price_store import PriceStore
+
+# --- 離線效能測試 ---
+# 用法 (於專案根目錄)：
+#   python -m benchmarks.run --output bench_results.json
+#   python -m benchmarks.run --quick --baseline bench_results.json --tolerance 0.25
+# 指定 --baseline 時，任何項目的中位數比基準慢超過 tolerance 即以結束碼 1 結束，可放在部署前的 CI 步驟。
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+BENCH_USER = {"uid": "bench-user", "email": "bench@example.com", "display_name": "Bench"}
+
+
+def measure(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return {"runs": repeat, "min_s": min(timings), "median_s": statistics.median(timings), "mean_s": statistics.fmean(timings)}
+
+
+def synthetic_prices(n_tickers, years):
+    tickers = fakes.TICKER_UNIVERSE[:n_tickers]
+    index = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=252 * years)
+    return pd.DataFrame({t: fakes.synthetic_closes(t, index) for t in tickers + ["SPY"]}, index=index), tickers
+
+
+# --- 計算核心 ---
+def bench_analytics(quick):
+    results = []
+    for n_tickers in ([3, 10] if quick else [3, 5, 10, 20]):
+        for years in ([5] if quick else [1, 5, 10]):
+            for n_portfolios in ([1, 30] if quick else [1, 30, 200]):
+                prices, tickers = synthetic_prices(n_tickers, years)
+                rng = np.random.default_rng(n_portfolios)
+                portfolios = [(tickers, list(rng.dirichlet(np.ones(n_tickers)))) for _ in range(n_portfolios)]
+                stats = measure(lambda: analytics.analyze_portfolios(prices, portfolios), repeat=3 if quick else 5)
+                results.append({"name": "analytics.analyze_portfolios", "params": {"tickers": n_tickers, "years": years, "portfolios": n_portfolios}, **stats})
+    for n_tickers in ([5] if quick else [3, 5, 10]):
+        for n_candidates in ([10000] if quick else [1000, 10000, 50000]):
+            prices, tickers = synthetic_prices(n_tickers, 5)
+            stats = measure(lambda: rebalance.what_if(prices, tickers, [1 / n_tickers] * n_tickers, n_candidates), repeat=3 if quick else 5)
+            results.append({"name": "rebalance.what_if", "params": {"tickers": n_tickers, "candidates": n_candidates}, **stats})
+    return results
+
+
+def bench_simulation(quick):
+    returns = np.random.default_rng(0).normal(0.0004, 0.01, 252 * 5)
+    results = []
+    for method in monte_carlo.METHODS:
+        for n_paths in ([1000, 10000] if quick else [1000, 10000, 100000]):
+            if method == "normal" and n_paths > 10000 and quick:
+                continue
+            # seed=None 跳過結果快取，量測的是實際模擬時間
+            stats = measure(lambda: monte_carlo.simulate_final_values(returns, n_paths=n_paths, method=method, seed=None), repeat=1 if n_paths >= 100000 else 3)
+            results.append({"name": "monte_carlo.simulate_final_values", "params": {"method": method, "paths": n_paths}, **stats})
+    return results
+
+
+# --- 完整頁面 ---
+@contextmanager
+def offline_environment(db, llm_latency=0.0, market_latency=0.0, news_latency=0.0):
+    """以替身取代所有外部服務，並讓價格資料庫、共用快取與建議快取寫到暫存目錄。"""
+    import firebase_admin
+    import newsapi
+    import pyrebase
+    import yfinance
+    from firebase_admin import credentials, firestore
+
+    import cache_backend
+    import model_gateway
+
+    market = fakes.FakeYFinance(latency=market_latency)
+    with tempfile.TemporaryDirectory() as tmp, ExitStack() as stack:
+        stack.enter_context(mock.patch.dict(os.environ, {**fakes.fake_firebase_env(), "CACHE_BACKEND": "sqlite", "CACHE_SQLITE_PATH": os.path.join(tmp, "cache.sqlite"),
+                                                             "PRICE_STORE_DIR": os.path.join(tmp, "prices"), "RECOMMENDATION_CACHE_PATH": os.path.join(tmp, "recommendations.sqlite")}))
+        stack.enter_context(mock.patch.object(cache_backend, "_default_backend", None))
+        stack.enter_context(mock.patch.object(yfinance, "download", market.download))
+        stack.enter_context(mock.patch.object(credentials, "Certificate", lambda creds: creds))
+        stack.enter_context(mock.patch.object(firebase_admin, "initialize_app", lambda *a, **k: None))
+        stack.enter_context(mock.patch.object(firestore, "client", lambda *a, **k: db))
+        stack.enter_context(mock.patch.object(pyrebase, "initialize_app", lambda config: fakes.FakePyrebaseApp()))
+        stack.enter_context(mock.patch.object(newsapi, "NewsApiClient", lambda api_key=None: fakes.FakeNewsApiClient(api_key, news_latency)))
+        stack.enter_context(mock.patch.object(model_gateway.ModelGateway, "call_gemini", lambda self, prompt, **k: fakes.fake_llm_response(prompt, llm_latency)))
+        stack.enter_context(mock.patch.object(model_gateway.ModelGateway, "call_azure", lambda self, prompt, **k: fakes.fake_llm_response(prompt, llm_latency)))
+        stack.enter_context(mock.patch.object(model_gateway.ModelGateway, "stream_gemini", lambda self, prompt, **k: fakes.fake_llm_stream(prompt, llm_latency)))
+        stack.enter_context(mock.patch.object(model_gateway.ModelGateway, "stream_azure", lambda self, prompt, **k: fakes.fake_llm_stream(prompt, llm_latency)))
+        yield market
+
+
+def clear_streamlit_caches():
+    import streamlit as st
+    st.cache_data.clear()
+    st.cache_resource.clear()
+
+
+def render_page(page, session_state=None, submit_form=False, user=BENCH_USER):
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(APP_PATH, default_timeout=300)
+    for key, value in fakes.fake_secrets().items():
+        at.secrets[key] = value
+    at.session_state["user"] = dict(user) if user else None
+    at.session_state["page"] = page
+    for key, value in (session_state or {}).items():
+        at.session_state[key] = value
+    at.run()
+    if submit_form:
+        next(b for b in at.button if b.label == "🚀 開始分析").click().run()
+    if at.exception:
+        raise RuntimeError(f"{page} 頁面執行失敗: {at.exception[0].message}")
+    return at
+
+
+def bench_pages(quick):
+    results = []
+    scenarios = [("儀表板", {}, 5), ("我的投資組合", {}, 5), ("我的投資組合", {"snapshots": True}, 5), ("新分析", {}, 5)]
+    for n_recs in ([5, 30] if quick else [5, 30, 200]):
+        scenarios.append(("歷史紀錄", {"expanded": False}, n_recs))
+        scenarios.append(("歷史紀錄", {"expanded": True}, n_recs))
+    for page, options, n_recs in scenarios:
+        db = fakes.FakeFirestore()
+        db.seed_recommendations(BENCH_USER["uid"], n_recs)
+        session_state = {f"perf_rec-{i:06d}": True for i in range(n_recs)} if options.get("expanded") else {}
+        with offline_environment(db) as market:
+            if options.get("snapshots"):
+                # 快照以另一個價格資料庫產生，頁面本身的價格資料庫仍是空的
+                with tempfile.TemporaryDirectory() as tmp:
+                    snapshots.build_all(db, PriceStore(root=tmp).get_closes)
+                db.reads = db.writes = 0
+                market.calls.clear()
+            clear_streamlit_caches()
+            cold = measure(lambda: render_page(page, session_state, submit_form=(page == "新分析")), repeat=1)
+            cold_reads, cold_downloads = db.reads, len(market.calls)
+            warm = measure(lambda: render_page(page, session_state, submit_form=(page == "新分析")), repeat=2 if quick else 3)
+        params = {"page": page, "recommendations": n_recs, **options}
+        results.append({"name": "page.cold", "params": params, "firestore_reads": cold_reads, "firestore_writes": db.writes, "market_downloads": cold_downloads, **cold})
+        results.append({"name": "page.warm", "params": params, **warm})
+    return results
+
+
+# --- 冷啟動 ---
+def bench_startup(quick):
+    """每次以新的行程渲染第一個頁面，量測整個行程 (含直譯器啟動與 import) 的時間。"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = []
+    for page, logged_in in [("登入", False), ("教育", False), ("開戶", False), ("儀表板", True)]:
+        command = [sys.executable, "-m", "benchmarks.startup", page] + (["--logged-in"] if logged_in else [])
+        timings, first_renders, child = [], [], None
+        for _ in range(2 if quick else 5):
+            start = time.perf_counter()
+            completed = subprocess.run(command, cwd=root, capture_output=True, text=True, check=True)
+            timings.append(time.perf_counter() - start)
+            child = json.loads(completed.stdout.strip().splitlines()[-1])
+            first_renders.append(child["first_render_s"])
+        results.append({
+            "name": "startup.cold", "params": {"page": page, "logged_in": logged_in}, "runs": len(timings),
+            "min_s": min(timings), "median_s": statistics.median(timings), "mean_s": statistics.fmean(timings),
+            "first_render_median_s": statistics.median(first_renders), "heavy_modules": child["heavy_modules"],
+        })
+    return results
+
+
+# --- 批次產生建議 ---
+def bench_bulk(quick):
+    """以假的模型 (每次呼叫 50 ms) 與 Firestore 量測不同同時呼叫數下的吞吐量。"""
+    import bulk
+    profiles = fakes.fake_profiles(200 if quick else 1000)
+    results = []
+    for concurrency in ([1, 16] if quick else [1, 4, 16, 64]):
+        reports = []
+        stats = measure(lambda: reports.append(bulk.run_bulk(profiles, fakes.FakeFirestore(), lambda model, prompt: fakes.fake_llm_response(prompt, 0.05), concurrency=concurrency)), repeat=1)
+        report = reports[-1]
+        results.append({"name": "bulk.run_bulk", "params": {"profiles": len(profiles), "concurrency": concurrency}, "per_second": report.throughput, "model_calls": report.model_calls, "batches": report.batches, "failed": report.failed, **stats})
+    return results
+
+
+# --- 結果輸出與比較 ---
+def result_key(result):
+    return result["name"], json.dumps(result["params"], sort_keys=True, ensure_ascii=False)
+
+
+def compare(results, baseline, tolerance):
+    previous = {result_key(r): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = previous.get(result_key(result))
+        if old and result["median_s"] > old["median_s"] * (1 + tolerance) and result["median_s"] - old["median_s"] > 0.005:
+            regressions.append({"name": result["name"], "params": result["params"], "baseline_s": old["median_s"], "current_s": result["median_s"]})
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="不連網的效能測試：計算核心、蒙地卡羅模擬、完整頁面、冷啟動與批次產生建議")
+    parser.add_argument("--output", default="bench_results.json", help="結果 JSON 檔案位置")
+    parser.add_argument("--quick", action="store_true", help="只跑較小的參數組合")
+    parser.add_argument("--suite", action="append", choices=["analytics", "simulation", "pages", "startup", "bulk"], help="只跑指定項目，可重複指定")
+    parser.add_argument("--baseline", help="用來比較的先前結果 JSON")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="允許比基準慢的比例")
+    args = parser.parse_args(argv)
+
+    suites = {"analytics": bench_analytics, "simulation": bench_simulation, "pages": bench_pages, "startup": bench_startup, "bulk": bench_bulk}
+    results = []
+    for name in args.suite or list(suites):
+        print(f"執行 {name} ...", file=sys.stderr)
+        results.extend(suites[name](args.quick))
+
+    report = {
+        "meta": {"created_at": datetime.now(timezone.utc).isoformat(), "commit": git_commit(), "python": platform.python_version(), "platform": platform.platform(), "quick": args.quick},
+        "results": results,
+    }
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report["regressions"] = compare(results, json.load(f), args.tolerance)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    for result in results:
+        print(f"{result['name']:<36} {json.dumps(result['params'], ensure_ascii=False):<70} {result['median_s'] * 1000:>10.1f} ms")
+    if report.get("regressions"):
+        print(f"發現 {len(report['regressions'])} 項效能退步，詳見 {args.output}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
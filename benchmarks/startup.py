@@ -0,0 +1,37 @@
+import time
+
+PROCESS_START = time.perf_counter()
+
+import argparse
+import json
+import sys
+
+# --- 冷啟動量測 (子行程) ---
+# 由 benchmarks.run 的 startup 項目以全新的 Python 行程呼叫，量測從行程開始到第一個頁面渲染完成的時間，
+# 並列出渲染後已載入的重量級套件。不需登入的頁面不套用離線替身，避免替身本身先載入這些套件。
+
+HEAVY_MODULES = ("plotly.express", "yfinance", "firebase_admin", "google.cloud.firestore", "pyrebase", "newsapi", "openai", "requests")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("page")
+    parser.add_argument("--logged-in", action="store_true")
+    args = parser.parse_args(argv)
+
+    from benchmarks import fakes, run
+    if args.logged_in:
+        db = fakes.FakeFirestore()
+        db.seed_recommendations(run.BENCH_USER["uid"], 5)
+        with run.offline_environment(db):
+            run.render_page(args.page)
+    else:
+        run.render_page(args.page, user=None)
+    print(json.dumps({
+        "first_render_s": time.perf_counter() - PROCESS_START,
+        "heavy_modules": [m for m in HEAVY_MODULES if m in sys.modules],
+    }))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import argparse
+import csv
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextvars import copy_context
+from dataclasses import dataclass, field
+
+import tracing
+from data_access import BATCH_SIZE, COLLECTION
+from model_gateway import MODEL_AZURE, MODEL_GEMINI, PROVIDERS, MissingCredentialsError, ModelError
+from prompts import build_recommendation_prompt, parse_recommendation
+from recommendation_cache import PROFILE_FIELDS, normalize_profile
+
+# --- 批次產生投資建議 (不經過 Streamlit 介面) ---
+# 讀取使用者條件檔 (JSONL 或 CSV)，相同的 (條件, 模型) 只詢問一次；以固定數量的工作執行緒同時呼叫模型，
+# 失敗或格式不符時以指數退避重試，結果以 Firestore 批次寫入 (每批最多 BATCH_SIZE 筆)。
+# 模型呼叫與資料庫都由參數傳入，可以改用 benchmarks.fakes 的替身在本機測試。
+
+MODEL_ALIASES = {"gemini": MODEL_GEMINI, "azure": MODEL_AZURE}
+
+
+@dataclass
+class BulkReport:
+    profiles: int = 0
+    unique_prompts: int = 0
+    succeeded: int = 0
+    failed: int = 0
+    cache_hits: int = 0
+    model_calls: int = 0
+    batches: int = 0
+    elapsed: float = 0.0
+    failures: list = field(default_factory=list)
+
+    @property
+    def throughput(self):
+        """每秒完成的建議數。"""
+        return self.succeeded / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        return (f"共 {self.profiles} 筆條件 ({self.unique_prompts} 組不重複)：成功 {self.succeeded}、失敗 {self.failed}；"
+                f"模型呼叫 {self.model_calls} 次、快取命中 {self.cache_hits} 次、批次寫入 {self.batches} 次；"
+                f"耗時 {self.elapsed:.1f} 秒，{self.throughput:.2f} 筆/秒")
+
+
+def load_profiles(path):
+    """讀取 .jsonl (每行一個 JSON 物件) 或 .csv (第一列為欄位名稱)。"""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if path.lower().endswith(".csv"):
+            return list(csv.DictReader(f))
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def generate(call_model, model, profile, max_attempts=3, backoff=1.0):
+    """呼叫模型並解析建議；ModelError 或格式不符時重試，缺少金鑰則直接失敗。"""
+    prompt = build_recommendation_prompt(*profile)
+    for attempt in range(max_attempts):
+        try:
+            return parse_recommendation(call_model(model, prompt))
+        except MissingCredentialsError:
+            raise
+        except (ModelError, ValueError):
+            if attempt + 1 >= max_attempts:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+
+def run_bulk(profiles, db, call_model, model=MODEL_GEMINI, concurrency=8, max_attempts=3, backoff=1.0, cache=None, dry_run=False):
+    """為每筆條件產生建議並寫入 Firestore，回傳 BulkReport。
+
+    call_model(model, prompt) 回傳模型原始回覆 (例如 ModelGateway.call)；cache 為 RecommendationCache，
+    命中時不呼叫模型。每列可用 "model" 欄位 (gemini / azure 或完整名稱) 覆寫預設模型。dry_run 時 db 可為 None。
+    """
+    report = BulkReport(profiles=len(profiles))
+    started = time.perf_counter()
+    lock = threading.Lock()
+
+    jobs = {}
+    for row in profiles:
+        row_model = MODEL_ALIASES.get(str(row.get("model") or "").lower(), row.get("model") or model)
+        missing = [f for f in ("user_id",) + PROFILE_FIELDS if not str(row.get(f) or "").strip()]
+        if missing or row_model not in PROVIDERS:
+            report.failed += 1
+            report.failures.append({**row, "error": f"缺少欄位: {', '.join(missing)}" if missing else f"未知的模型: {row_model}"})
+            continue
+        jobs.setdefault((row_model, normalize_profile(row)), []).append(row)
+    report.unique_prompts = len(jobs)
+
+    def counted_call(m, prompt):
+        with lock:
+            report.model_calls += 1
+        return call_model(m, prompt)
+
+    def work(key):
+        m, profile = key
+        profile_dict = dict(zip(PROFILE_FIELDS, profile))
+        rec = cache.get(profile_dict, m, record_request=False) if cache is not None else None
+        if rec:
+            return rec, True
+        with tracing.span("bulk.generate", model=PROVIDERS[m]):
+            rec = generate(counted_call, m, profile, max_attempts, backoff)
+        if cache is not None:
+            cache.put(profile_dict, m, rec)
+        return rec, False
+
+    if not dry_run:
+        from firebase_admin import firestore
+        batch, pending = db.batch(), []
+
+    def commit():
+        nonlocal batch, pending
+        try:
+            with tracing.span("firestore.write", op="batch", writes=len(pending)):
+                batch.commit()
+            report.succeeded += len(pending)
+        except Exception as e:
+            report.failed += len(pending)
+            report.failures.extend({**row, "error": f"寫入失敗: {e}"} for row in pending)
+        report.batches += 1
+        batch, pending = db.batch(), []
+
+    # 模型回覆陸續完成時就加入批次，湊滿 BATCH_SIZE 筆即寫入，不必等全部完成
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bulk") as executor:
+        futures = {executor.submit(copy_context().run, work, key): key for key in jobs}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                rec, cached = future.result()
+            except Exception as e:
+                report.failed += len(jobs[key])
+                report.failures.extend({**row, "error": str(e)} for row in jobs[key])
+                continue
+            report.cache_hits += cached
+            for row in jobs[key]:
+                if dry_run:
+                    report.succeeded += 1
+                    continue
+                rec_data = {"user_id": row["user_id"], "timestamp": firestore.SERVER_TIMESTAMP, "tickers": rec['tickers'], "weights": rec['weights'], "reason": rec['reason'], "model": key[0]}
+                batch.set(db.collection(COLLECTION).document(), rec_data)
+                pending.append(row)
+                if len(pending) >= BATCH_SIZE:
+                    commit()
+    if not dry_run and pending:
+        commit()
+    report.elapsed = time.perf_counter() - started
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="依使用者條件檔批次產生 AI 投資建議並寫入 Firestore")
+    parser.add_argument("path", help="使用者條件檔 (.jsonl 或 .csv)，欄位：user_id、" + "、".join(PROFILE_FIELDS) + "，可選 model")
+    parser.add_argument("--user-id", help="條件檔沒有 user_id 欄位時使用的使用者 ID")
+    parser.add_argument("--model", default="gemini", help="預設模型：gemini、azure 或完整名稱")
+    parser.add_argument("--concurrency", type=int, default=8, help="同時進行的模型呼叫數 (另受 GEMINI_MAX_CONCURRENCY / AZURE_OPENAI_MAX_CONCURRENCY 限制)")
+    parser.add_argument("--attempts", type=int, default=3, help="每組條件最多嘗試次數")
+    parser.add_argument("--no-cache", action="store_true", help="不使用也不更新 AI 建議快取")
+    parser.add_argument("--dry-run", action="store_true", help="只呼叫模型，不寫入 Firestore")
+    parser.add_argument("--failures", help="將失敗的條件與原因寫入此 JSONL 檔")
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+    from data_access import firestore_client
+    from model_gateway import ModelGateway
+    from recommendation_cache import RecommendationCache
+    load_dotenv()
+    profiles = [{**row, "user_id": args.user_id} if args.user_id and not row.get("user_id") else row for row in load_profiles(args.path)]
+    gateway = ModelGateway()
+    report = run_bulk(
+        profiles, None if args.dry_run else firestore_client(), gateway.call, model=MODEL_ALIASES.get(args.model.lower(), args.model),
+        concurrency=args.concurrency, max_attempts=args.attempts, cache=None if args.no_cache else RecommendationCache(), dry_run=args.dry_run,
+    )
+    print(report.summary())
+    if args.failures and report.failures:
+        with open(args.failures, "w", encoding="utf-8") as f:
+            for failure in report.failures:
+                f.write(json.dumps(failure, ensure_ascii=False) + "\n")
+    return 1 if report.failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,232 @@
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# --- 共用快取後端 ---
+# 行情、新聞摘要、AI 回覆與績效計算結果都透過 Cache 存取，後端可替換：
+#   - memory：行程內 LRU (與原本的行為相同，重啟即消失)
+#   - sqlite：本機磁碟，重啟後仍有效 (預設)
+#   - redis：多個副本共用，需設定 CACHE_REDIS_URL；容量上限由 Redis 的 maxmemory 與淘汰策略控制
+# 每個 Cache 有自己的命名空間與 TTL，並記錄命中、未命中、寫入與錯誤次數。
+# 每次頁面執行都會讀取的命名空間可加上 local_entries，在共用後端前面放一層行程內 LRU (最多保留 local_ttl 秒)。
+# sqlite/redis 以 pickle 保存資料，只能連到自己控制的 Redis。後端出錯時一律視為未命中，不影響頁面。
+
+MISSING = object()
+DEFAULT_SQLITE_PATH = ".cache.sqlite"
+DEFAULT_MEMORY_ENTRIES = 1024
+DEFAULT_SQLITE_ENTRIES = 20000
+DEFAULT_LOCAL_TTL = 60
+
+
+def make_key(*parts):
+    return json.dumps(parts, ensure_ascii=False, default=str, separators=(",", ":"))
+
+
+class MemoryBackend:
+    def __init__(self, max_entries=DEFAULT_MEMORY_ENTRIES):
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+            if entry[0] is not None and entry[0] <= time.time():
+                del self._entries[key]
+                return MISSING
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl if ttl else None, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class SQLiteBackend:
+    def __init__(self, path=None, max_entries=DEFAULT_SQLITE_ENTRIES, evict_every=100):
+        self.path = path or os.getenv("CACHE_SQLITE_PATH", DEFAULT_SQLITE_PATH)
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+        self.evictions = 0
+        self._writes = 0
+        self._touched = {}
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires_at REAL, last_used REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_last_used ON cache (last_used)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key):
+        # 只讀取；last_used 先記在記憶體，寫入時再批次更新，命中不必取得寫入鎖。過期項目留給 _evict 清理
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] <= now):
+            return MISSING
+        with self._lock:
+            self._touched[key] = now
+        return pickle.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % self.evict_every == 0
+            touched, self._touched = self._touched, {}
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)", (key, payload, now + ttl if ttl else None, now))
+            if touched:
+                conn.executemany("UPDATE cache SET last_used = ? WHERE key = ?", [(used, k) for k, used in touched.items() if k != key])
+        if evict:
+            self._evict(now)
+
+    def _evict(self, now):
+        # 每寫入 evict_every 次才清理一次：刪除過期項目，超過容量時依最後使用時間淘汰
+        with self._connect() as conn:
+            expired = conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,)).rowcount
+            overflow = conn.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (self.max_entries,)).rowcount
+        self.evictions += expired + overflow
+
+    def delete(self, key):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+
+class RedisBackend:
+    def __init__(self, url=None, prefix="robo-advisor:"):
+        import redis
+        self.client = redis.Redis.from_url(url or os.getenv("CACHE_REDIS_URL"), socket_timeout=2, socket_connect_timeout=2)
+        self.prefix = prefix
+        self.evictions = None
+
+    def get(self, key):
+        payload = self.client.get(self.prefix + key)
+        return MISSING if payload is None else pickle.loads(payload)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), ex=max(int(ttl), 1) if ttl else None)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+
+_default_backend = None
+_default_lock = threading.Lock()
+
+
+def default_backend():
+    """依 CACHE_BACKEND (memory / sqlite / redis) 建立行程共用的後端；未設定時有 CACHE_REDIS_URL 用 redis，否則用 sqlite。"""
+    global _default_backend
+    with _default_lock:
+        if _default_backend is None:
+            kind = os.getenv("CACHE_BACKEND") or ("redis" if os.getenv("CACHE_REDIS_URL") else "sqlite")
+            if kind == "redis":
+                _default_backend = RedisBackend()
+            elif kind == "memory":
+                _default_backend = MemoryBackend()
+            else:
+                _default_backend = SQLiteBackend()
+        return _default_backend
+
+
+# --- 命名空間與統計 ---
+_caches = weakref.WeakSet()
+
+
+class Cache:
+    def __init__(self, namespace, backend=None, ttl=None, local_entries=None, local_ttl=DEFAULT_LOCAL_TTL):
+        self.namespace = namespace
+        self.backend = backend if backend is not None else default_backend()
+        self.ttl = ttl
+        # 其他副本寫入或刪除的項目最晚 local_ttl 秒後才會反映在這一層
+        self.local = MemoryBackend(local_entries) if local_entries and not isinstance(self.backend, MemoryBackend) else None
+        self.local_ttl = local_ttl
+        self.hits = self.misses = self.sets = self.errors = self.local_hits = 0
+        _caches.add(self)
+
+    def _local_ttl(self, ttl):
+        return min(ttl, self.local_ttl) if ttl else self.local_ttl
+
+    def get(self, key, default=None):
+        full_key = make_key(self.namespace, key)
+        value = self.local.get(full_key) if self.local is not None else MISSING
+        if value is not MISSING:
+            self.hits += 1
+            self.local_hits += 1
+            return value
+        try:
+            value = self.backend.get(full_key)
+        except Exception:
+            self.errors += 1
+            value = MISSING
+        if value is MISSING:
+            self.misses += 1
+            return default
+        if self.local is not None:
+            self.local.set(full_key, value, self._local_ttl(self.ttl))
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        full_key, ttl = make_key(self.namespace, key), ttl if ttl is not None else self.ttl
+        if self.local is not None:
+            self.local.set(full_key, value, self._local_ttl(ttl))
+        try:
+            self.backend.set(full_key, value, ttl)
+            self.sets += 1
+        except Exception:
+            self.errors += 1
+
+    def delete(self, key):
+        full_key = make_key(self.namespace, key)
+        if self.local is not None:
+            self.local.delete(full_key)
+        try:
+            self.backend.delete(full_key)
+        except Exception:
+            self.errors += 1
+
+    def get_or_set(self, key, compute, ttl=None):
+        value = self.get(key, MISSING)
+        if value is MISSING:
+            value = compute()
+            self.set(key, value, ttl)
+        return value
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "namespace": self.namespace, "backend": type(self.backend).__name__, "hits": self.hits, "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None, "local_hits": self.local_hits, "sets": self.sets, "errors": self.errors, "evictions": self.backend.evictions,
+        }
+
+
+def all_stats():
+    return sorted((cache.stats() for cache in list(_caches)), key=lambda s: s["namespace"])
@@ -0,0 +1,138 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+# --- 圖表資料準備 (不依賴 Streamlit) ---
+# 時間序列以 LTTB (Largest-Triangle-Three-Buckets) 降採樣到固定點數，保留高低點與走勢形狀，
+# 傳給瀏覽器的資料量不隨回測長度增加；模擬結果只傳分位數與直方圖，不傳原始樣本。
+# 建好的圖表與降採樣結果依輸入放在 ChartCache，rerun 時直接重用。
+
+DEFAULT_MAX_POINTS = 500
+DEFAULT_BINS = 60
+
+
+def lttb_indices(y, threshold):
+    """回傳 LTTB 挑選的索引 (含頭尾)，y 必須不含 NaN。"""
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    y = np.asarray(y, dtype=float)
+    x = np.arange(n, dtype=float)
+    every = (n - 2) / (threshold - 2)
+    edges = np.floor(np.arange(threshold - 1) * every).astype(int) + 1
+    indices = np.empty(threshold, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[end:next_end].mean(), y[end:next_end].mean()
+        # 與前一個選中點、下一桶平均點構成的三角形面積最大者
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+    return indices
+
+
+def downsample(data, max_points=DEFAULT_MAX_POINTS):
+    """將 Series 或 DataFrame 降到約 max_points 列；多欄時各欄分配點數後取聯集，保留原始列的數值。"""
+    if len(data) <= max_points:
+        return data
+    frame = data.to_frame() if isinstance(data, pd.Series) else data
+    per_column = max(max_points // max(frame.shape[1], 1), 3)
+    keep = np.zeros(len(frame), dtype=bool)
+    for column in frame.columns:
+        values = frame[column].to_numpy(dtype=float)
+        valid = np.flatnonzero(~np.isnan(values))
+        if len(valid):
+            keep[valid[lttb_indices(values[valid], per_column)]] = True
+    return data[keep]
+
+
+# --- 分佈摘要 ---
+@dataclass(frozen=True)
+class DistributionSummary:
+    n: int
+    mean: float
+    percentiles: dict
+    counts: np.ndarray
+    edges: np.ndarray
+
+
+def distribution_summary(values, percentiles=(5, 25, 50, 75, 95), bins=DEFAULT_BINS):
+    values = np.asarray(values, dtype=float)
+    q = np.percentile(values, list(percentiles))
+    # 直方圖只涵蓋 0.5%~99.5%，避免少數極端路徑把橫軸拉得太長
+    low, high = np.percentile(values, [0.5, 99.5])
+    counts, edges = np.histogram(values, bins=bins, range=(low, high))
+    return DistributionSummary(len(values), float(values.mean()), dict(zip(percentiles, q.tolist())), counts, edges)
+
+
+def distribution_figure(summary, title, x_label="價值 (USD)"):
+    import plotly.graph_objects as go
+    centers = (summary.edges[:-1] + summary.edges[1:]) / 2
+    markers = [(q, dash) for q, dash in ((5, "dot"), (50, "solid"), (95, "dot")) if q in summary.percentiles]
+    # 直接寫入 layout 的 shapes/annotations，比逐條 add_vline 快得多
+    shapes = [{"type": "line", "xref": "x", "yref": "paper", "x0": summary.percentiles[q], "x1": summary.percentiles[q], "y0": 0, "y1": 1, "line": {"dash": dash, "color": "#EF553B"}} for q, dash in markers]
+    annotations = [{"xref": "x", "yref": "paper", "x": summary.percentiles[q], "y": 1, "yanchor": "bottom", "showarrow": False, "text": f"P{q}: ${summary.percentiles[q]:,.0f}"} for q, _ in markers]
+    return go.Figure(
+        go.Bar(x=centers, y=summary.counts / summary.n, width=np.diff(summary.edges), hovertemplate="%{x:$,.0f}: %{y:.2%}<extra></extra>"),
+        layout={"title": title, "xaxis_title": x_label, "yaxis_title": "機率", "yaxis_tickformat": ".0%", "bargap": 0, "showlegend": False, "shapes": shapes, "annotations": annotations},
+    )
+
+
+# --- 效率前緣 ---
+def frontier_figure(result, max_points=3000):
+    """rebalance.what_if 的結果：候選點 (最多 max_points 個，依夏普比率上色)、效率前緣與三個標記點。"""
+    import plotly.graph_objects as go
+    # 候選權重本身是隨機抽樣，取前 max_points 個即為均勻的子樣本
+    shown = slice(0, min(max_points, len(result.volatilities)))
+    hover = "波動 %{x:.2%}<br>報酬 %{y:.2%}<extra></extra>"
+    traces = [
+        go.Scattergl(x=result.volatilities[shown], y=result.expected_returns[shown], mode="markers", name="候選權重", hovertemplate=hover,
+                     marker={"size": 4, "color": result.sharpe_ratios[shown], "colorscale": "Viridis", "colorbar": {"title": "夏普"}, "opacity": 0.6}),
+        go.Scatter(x=result.volatilities[result.frontier], y=result.expected_returns[result.frontier], mode="lines", name="效率前緣", hovertemplate=hover, line={"color": "#EF553B"}),
+    ]
+    for index, name, symbol in ((result.target, "目前建議", "star"), (result.min_variance, "最小變異", "diamond"), (result.max_sharpe, "最大夏普", "triangle-up")):
+        traces.append(go.Scatter(x=[result.volatilities[index]], y=[result.expected_returns[index]], mode="markers", name=name, hovertemplate=hover, marker={"size": 14, "symbol": symbol, "line": {"width": 1, "color": "black"}}))
+    return go.Figure(traces, layout={"title": "風險與報酬 (年化)", "xaxis_title": "年化波動率", "yaxis_title": "期望年化報酬率", "xaxis_tickformat": ".0%", "yaxis_tickformat": ".0%", "legend": {"orientation": "h", "y": -0.2}})
+
+
+# --- 快取 ---
+def fingerprint(values):
+    """陣列、Series 或 DataFrame 內容的雜湊，作為快取鍵的一部分。"""
+    if isinstance(values, (pd.Series, pd.DataFrame)):
+        parts = [values.to_numpy(), values.index.to_numpy()] + ([np.asarray(values.columns, dtype=str)] if isinstance(values, pd.DataFrame) else [])
+    else:
+        parts = [np.asarray(values)]
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(str(part.shape).encode())
+        digest.update(np.ascontiguousarray(part).tobytes() if part.dtype != object else str(part.tolist()).encode())
+    return digest.hexdigest()
+
+
+class ChartCache:
+    """以輸入為鍵的 LRU 快取，保存降採樣後的資料與建好的 Plotly 圖表；取回的物件為共用，呼叫端不可修改。"""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_build(self, key, build):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        value = build()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
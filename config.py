@@ -0,0 +1,21 @@
+import os
+
+# --- 設定讀取 ---
+# 優先使用環境變數 (Cloud Run)，其次為 Streamlit secrets.toml；在 Streamlit 之外
+# (例如命令列工具) 執行時沒有 secrets 也不會報錯。
+
+
+def get_setting(env_name, *secret_path, default=None):
+    value = os.getenv(env_name)
+    if value:
+        return value
+    if not secret_path:
+        return default
+    try:
+        import streamlit as st
+        node = st.secrets
+        for part in secret_path:
+            node = node[part]
+        return node
+    except Exception:
+        return default
@@ -0,0 +1,148 @@
+import base64
+import json
+import threading
+
+import tracing
+from config import get_setting
+
+# --- 推薦紀錄資料存取 ---
+# 每個 session 持有一個 RecommendationRepository，快取該使用者的推薦文件；
+# 切換頁面或重新執行腳本時不再查詢 Firestore。新增紀錄時直接寫入快取 (write-through)，
+# 也可以選擇以 snapshot listener 讓快取隨 Firestore 即時更新。
+# 歷史頁面以 start_after 游標分頁讀取，已載入的頁面同樣保留在快取中。
+
+COLLECTION = "recommendations"
+BATCH_SIZE = 400  # Firestore 每個批次最多 500 筆寫入
+
+
+def firestore_client():
+    """在 Streamlit 之外 (命令列工具) 以 FIREBASE_CREDS_BASE64 初始化 Firebase Admin SDK，回傳 Firestore client。"""
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+    creds_base64 = get_setting("FIREBASE_CREDS_BASE64", "firebase_credentials", "base64")
+    if not creds_base64:
+        raise RuntimeError("缺少 FIREBASE_CREDS_BASE64 設定！")
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(credentials.Certificate(json.loads(base64.b64decode(creds_base64).decode("utf-8"))))
+    return firestore.client()
+
+
+class RecommendationRepository:
+    def __init__(self, db, user_id):
+        self.db = db
+        self.user_id = user_id
+        self._lock = threading.Lock()
+        self._latest = None
+        self._all = None
+        self._loaded = []
+        self._cursor = None
+        self._exhausted = False
+        self._shown = 0
+        self._watch = None
+
+    def _query(self):
+        from firebase_admin import firestore
+        return self.db.collection(COLLECTION).where("user_id", "==", self.user_id).order_by("timestamp", direction=firestore.Query.DESCENDING)
+
+    def latest(self):
+        """回傳最新一筆 (doc_id, dict)，沒有紀錄時回傳 None。"""
+        with self._lock:
+            if self._all is not None:
+                return self._all[0] if self._all else None
+            if self._latest is not None:
+                return self._latest or None
+        with tracing.span("firestore.query", op="latest"):
+            doc = next(self._query().limit(1).stream(), None)
+        with self._lock:
+            self._latest = (doc.id, doc.to_dict()) if doc else ()
+            return self._latest or None
+
+    def list(self):
+        """回傳使用者全部推薦 [(doc_id, dict), ...]，依時間由新到舊。"""
+        with self._lock:
+            if self._all is not None:
+                return list(self._all)
+        with tracing.span("firestore.query", op="list"):
+            docs = [(doc.id, doc.to_dict()) for doc in self._query().stream()]
+        with self._lock:
+            self._all = docs
+            self._latest = docs[0] if docs else ()
+            return list(docs)
+
+    def loaded(self):
+        """回傳目前已分頁載入的紀錄與是否還有更舊的紀錄：([(doc_id, dict), ...], has_more)。"""
+        with self._lock:
+            if self._all is not None:
+                # 已有完整快取時不再查詢 Firestore，但仍只回傳已翻到的頁數
+                shown = self._shown_count()
+                return list(self._all[:shown]), shown < len(self._all)
+            return list(self._loaded), not self._exhausted
+
+    def _shown_count(self):
+        return max(self._shown, len(self._loaded))
+
+    def load_more(self, page_size):
+        """以 start_after 游標再讀取一頁較舊的紀錄，回傳新載入的筆數。"""
+        with self._lock:
+            if self._all is not None:
+                shown = self._shown_count()
+                self._shown = min(shown + page_size, len(self._all))
+                return self._shown - shown
+            if self._exhausted:
+                return 0
+            query = self._query()
+            if self._cursor is not None:
+                query = query.start_after(self._cursor)
+        with tracing.span("firestore.query", op="page", page_size=page_size):
+            docs = list(query.limit(page_size).stream())
+        with self._lock:
+            known = {doc_id for doc_id, _ in self._loaded}
+            self._loaded.extend((doc.id, doc.to_dict()) for doc in docs if doc.id not in known)
+            if docs:
+                self._cursor = docs[-1]
+            self._exhausted = len(docs) < page_size
+            if self._latest is None:
+                self._latest = self._loaded[0] if self._loaded else ()
+        return len(docs)
+
+    def add(self, rec_data):
+        """寫入 Firestore，並讀回含伺服器時間的文件放到快取最前面 (只多 1 次讀取)。"""
+        with tracing.span("firestore.write", op="add"):
+            _, doc_ref = self.db.collection(COLLECTION).add(rec_data)
+            doc = doc_ref.get()
+        entry = (doc.id, doc.to_dict())
+        with self._lock:
+            self._latest = entry
+            if self._all is not None:
+                self._all = [entry] + [e for e in self._all if e[0] != entry[0]]
+                if self._shown:
+                    self._shown += 1
+            if self._loaded or self._exhausted:
+                self._loaded.insert(0, entry)
+        return entry
+
+    def invalidate(self):
+        with self._lock:
+            self._latest = None
+            self._all = None
+            self._loaded = []
+            self._cursor = None
+            self._exhausted = False
+            self._shown = 0
+
+    # --- 選用：即時同步 ---
+    def watch(self):
+        """以 snapshot listener 維持完整快取；listener 在背景執行緒回呼。"""
+        if self._watch is None:
+            self._watch = self._query().on_snapshot(self._on_snapshot)
+
+    def _on_snapshot(self, docs, changes, read_time):
+        entries = [(doc.id, doc.to_dict()) for doc in docs]
+        with self._lock:
+            self._all = entries
+            self._latest = entries[0] if entries else ()
+
+    def close(self):
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
@@ -0,0 +1,246 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from datetime import timedelta
+
+import pandas as pd
+
+import tracing
+
+# --- 行情下載代理 (整個行程共用) ---
+# 所有 session 的下載請求都經過同一個 MarketDataBroker：
+#   - 相同 (代碼, 起日, 迄日) 的請求若已在下載中，直接等待同一個結果
+#   - 短時間內到達、區間相同的不同代碼併成一次多代碼的 yf.download
+#   - 以 token bucket 限制對 Yahoo 的請求頻率；被限流時暫停所有下載並以指數退避重試
+#   - 傳入 cache (cache_backend.Cache) 時，下載結果依 (代碼, 起日, 迄日) 存入共用快取，其他副本可直接取用
+# 只有一個工作執行緒依序下載，yfinance 的錯誤日誌才能對應到正確的那一批。
+
+# 未傳入的參數在建立 MarketDataBroker 時才從環境變數讀取
+DEFAULT_RATE_PER_MINUTE = 30
+DEFAULT_BURST = 5
+DEFAULT_BATCH_MS = 50
+MAX_TICKERS_PER_DOWNLOAD = 50
+_RATE_LIMIT_MARKERS = ("YFRateLimitError", "Too Many Requests", "Rate limited", "429")
+
+
+class MarketDataError(Exception):
+    pass
+
+
+class RateLimitedError(MarketDataError):
+    pass
+
+
+class _ErrorCollector(logging.Handler):
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def download_closes(tickers, start, end):
+    """以 yfinance 下載還原權值收盤價，永遠回傳以代碼為欄位的 DataFrame。
+
+    yf.download 遇到限流只會寫錯誤日誌並回傳空欄位，這裡從日誌辨識出來並拋出 RateLimitedError，
+    呼叫端才不會把它當成「沒有歷史資料」。
+    """
+    import yfinance as yf
+    collector = _ErrorCollector()
+    yf_logger = logging.getLogger("yfinance")
+    yf_logger.addHandler(collector)
+    try:
+        data = yf.download(list(tickers), start=start, end=end, auto_adjust=True, progress=False)
+    except Exception as e:
+        if any(marker in f"{type(e).__name__} {e}" for marker in _RATE_LIMIT_MARKERS):
+            raise RateLimitedError("Yahoo Finance 暫時限制查詢次數，請稍後再試。") from e
+        raise
+    finally:
+        yf_logger.removeHandler(collector)
+    if any(marker in message for message in collector.messages for marker in _RATE_LIMIT_MARKERS):
+        raise RateLimitedError("Yahoo Finance 暫時限制查詢次數，請稍後再試。")
+    if data is None or data.empty:
+        return pd.DataFrame()
+    closes = data["Close"]
+    if isinstance(closes, pd.Series):
+        closes = closes.to_frame(name=tickers[0])
+    return closes
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        """rate 為每秒補充的 token 數，capacity 為可累積的上限 (允許的瞬間請求數)。"""
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """被限流時呼叫：清空 token，並在 seconds 秒內不發出任何請求。"""
+        with self._lock:
+            self._tokens = 0.0
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class MarketDataBroker:
+    def __init__(self, fetch=download_closes, rate_per_minute=None, burst=None, batch_window=None, max_retries=3, backoff=2.0, cache=None):
+        if rate_per_minute is None:
+            rate_per_minute = float(os.getenv("MARKET_DATA_RATE_PER_MINUTE", DEFAULT_RATE_PER_MINUTE))
+        if burst is None:
+            burst = int(os.getenv("MARKET_DATA_BURST", DEFAULT_BURST))
+        self._fetch = fetch
+        self.cache = cache
+        self.bucket = TokenBucket(rate_per_minute / 60, burst)
+        self.batch_window = batch_window if batch_window is not None else int(os.getenv("MARKET_DATA_BATCH_MS", DEFAULT_BATCH_MS)) / 1000
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._cond = threading.Condition()
+        self._inflight = {}
+        self._uncached = set()
+        self._pending = {}
+        self._worker = None
+        self.stats = {"requests": 0, "tickers": 0, "cached": 0, "coalesced": 0, "downloads": 0, "rate_limited": 0}
+
+    def download(self, tickers, start, end, use_cache=True):
+        """與 download_closes 相同的介面，可直接作為 PriceStore 的 downloader。
+
+        use_cache=False 時不讀寫共用快取 (即時報價)，但仍與其他請求合併並受頻率限制。
+        """
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        futures, columns = {}, {}
+        if self.cache is not None and use_cache:
+            for ticker in dict.fromkeys(tickers):
+                series = self.cache.get((ticker, start, end))
+                if series is not None:
+                    columns[ticker] = series
+        with self._cond:
+            self.stats["requests"] += 1
+            self.stats["cached"] += len(columns)
+            for ticker in dict.fromkeys(tickers):
+                if ticker in columns:
+                    continue
+                key = (ticker, start, end)
+                future = self._inflight.get(key)
+                if future is None:
+                    future = self._inflight[key] = Future()
+                    if not use_cache:
+                        self._uncached.add(key)
+                    self._pending.setdefault((start, end), {})[ticker] = future
+                    self.stats["tickers"] += 1
+                else:
+                    self.stats["coalesced"] += 1
+                futures[ticker] = future
+            if not futures:
+                return pd.DataFrame(columns, columns=list(columns))
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="market-data-broker", daemon=True)
+                self._worker.start()
+            self._cond.notify()
+        columns.update((ticker, future.result()) for ticker, future in futures.items())
+        columns = {ticker: columns[ticker] for ticker in dict.fromkeys(tickers)}
+        return pd.DataFrame(columns, columns=list(columns))
+
+    # --- 工作執行緒 ---
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+            # 稍等一下，讓同時開啟儀表板的其他 session 的請求併入同一批
+            time.sleep(self.batch_window)
+            with self._cond:
+                batches, self._pending = self._pending, {}
+            for (start, end), futures in batches.items():
+                tickers = list(futures)
+                for i in range(0, len(tickers), MAX_TICKERS_PER_DOWNLOAD):
+                    chunk = tickers[i:i + MAX_TICKERS_PER_DOWNLOAD]
+                    self._download_batch({t: futures[t] for t in chunk}, start, end)
+
+    def _download_batch(self, futures, start, end):
+        tickers, data, error = list(futures), None, None
+        with tracing.span("market_data.batch", tickers=len(tickers)):
+            for attempt in range(self.max_retries + 1):
+                self.bucket.acquire()
+                try:
+                    self.stats["downloads"] += 1
+                    data = self._fetch(tickers, start, end)
+                    break
+                except RateLimitedError as e:
+                    self.stats["rate_limited"] += 1
+                    error = e
+                    if attempt < self.max_retries:
+                        self.bucket.pause(self.backoff * 2 ** attempt)
+                except Exception as e:
+                    error = e
+                    break
+        with self._cond:
+            cacheable = set()
+            for ticker in tickers:
+                self._inflight.pop((ticker, start, end), None)
+                if (ticker, start, end) in self._uncached:
+                    self._uncached.discard((ticker, start, end))
+                else:
+                    cacheable.add(ticker)
+        for ticker, future in futures.items():
+            if data is None:
+                future.set_exception(error)
+            else:
+                if ticker in data.columns:
+                    series = data[ticker]
+                else:
+                    empty_index = data.index[:0] if isinstance(data.index, pd.DatetimeIndex) else pd.DatetimeIndex([])
+                    series = pd.Series(dtype="float64", index=empty_index)
+                if self.cache is not None and ticker in cacheable:
+                    self.cache.set((ticker, start, end), series)
+                future.set_result(series)
+
+
+# --- 最新報價 (整個行程共用) ---
+# 即時追蹤每個 session 定時需要最新報價；同一代碼在 max_age 秒內只向 broker 下載一次，
+# 開著頁面的 session 再多，對 Yahoo 的請求數也只與代碼數與更新間隔有關。
+
+class LatestQuotes:
+    def __init__(self, download, ttl=60):
+        """download 為 MarketDataBroker.download；ttl 為未指定 max_age 時報價的有效秒數。"""
+        self._download = download
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.stats = {"hits": 0, "misses": 0}
+
+    def recent_closes(self, tickers, max_age=None):
+        """回傳各代碼最近一週的日線 (盤中最後一點為最新成交價)，只為過期或缺少的代碼下載，不讀寫共用快取。"""
+        max_age = self.ttl if max_age is None else max_age
+        tickers = list(dict.fromkeys(tickers))
+        now = time.monotonic()
+        with self._lock:
+            columns = {t: entry[1] for t in tickers if (entry := self._entries.get(t)) is not None and now - entry[0] < max_age}
+            self.stats["hits"] += len(columns)
+            self.stats["misses"] += len(tickers) - len(columns)
+        missing = [t for t in tickers if t not in columns]
+        if missing:
+            today = pd.Timestamp.now().normalize()
+            data = self._download(missing, today - timedelta(days=7), today + timedelta(days=1), use_cache=False)
+            fetched = time.monotonic()
+            with self._lock:
+                for ticker in missing:
+                    columns[ticker] = data[ticker] if ticker in data.columns else pd.Series(dtype="float64")
+                    self._entries[ticker] = (fetched, columns[ticker])
+        return pd.DataFrame({t: columns[t] for t in tickers}, columns=tickers)
@@ -0,0 +1,197 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextvars import copy_context
+
+import tracing
+from config import get_setting
+from prompts import SYSTEM_PROMPT
+
+# --- LLM 呼叫閘道 ---
+# 整個行程共用一組 keep-alive 連線 (Gemini 的 requests.Session、Azure 的 AzureOpenAI client)，
+# 呼叫在執行緒池中進行，並依供應商限制同時請求數。
+# stream_* 以產生器逐段回傳文字 (Gemini streamGenerateContent / Azure stream=True)，畫面可以邊收邊顯示。
+
+MODEL_GEMINI = "Google Gemini 2.5 Flash"
+MODEL_AZURE = "Azure OpenAI (GPT-4o mini)"
+PROVIDERS = {MODEL_GEMINI: "gemini", MODEL_AZURE: "azure"}
+
+GEMINI_MODEL = "gemini-2.5-flash-preview-05-20"
+GEMINI_URL = "https://generativelanguage.googleapis.com/v1beta/models/{model}:{method}"
+REQUEST_TIMEOUT = 60
+
+
+class ModelError(Exception):
+    pass
+
+
+class MissingCredentialsError(ModelError):
+    pass
+
+
+class ModelGateway:
+    def __init__(self, gemini_concurrency=None, azure_concurrency=None):
+        self._limits = {
+            "gemini": gemini_concurrency or int(os.getenv("GEMINI_MAX_CONCURRENCY", "8")),
+            "azure": azure_concurrency or int(os.getenv("AZURE_OPENAI_MAX_CONCURRENCY", "8")),
+        }
+        self._semaphores = {provider: threading.BoundedSemaphore(n) for provider, n in self._limits.items()}
+        self._executor = ThreadPoolExecutor(max_workers=sum(self._limits.values()), thread_name_prefix="model-gateway")
+        self._client_lock = threading.Lock()
+        self._session = None
+        self._azure_client = None
+
+    # --- 共用連線 ---
+    @property
+    def session(self):
+        with self._client_lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+                # 連線失敗與 429/5xx 由 urllib3 以指數退避重試；重試在發出請求的執行緒進行：
+                # call_gemini 經由 submit/race 時在執行緒池，stream_gemini 與新聞摘要則在呼叫端 (Streamlit 腳本) 執行緒
+                retry = Retry(total=3, backoff_factor=1.0, status_forcelist=(429, 500, 502, 503, 504), allowed_methods=frozenset({"POST"}))
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=self._limits["gemini"], max_retries=retry)
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.headers.update({'Content-Type': 'application/json'})
+                self._session = session
+            return self._session
+
+    @property
+    def azure_client(self):
+        with self._client_lock:
+            if self._azure_client is None:
+                from openai import AzureOpenAI
+                endpoint = get_setting("AZURE_OPENAI_ENDPOINT", "azure_openai", "endpoint")
+                api_key = get_setting("AZURE_OPENAI_API_KEY", "azure_openai", "api_key")
+                api_version = get_setting("AZURE_OPENAI_API_VERSION", "azure_openai", "api_version")
+                if not all([endpoint, api_key, api_version]):
+                    raise MissingCredentialsError("缺少 Azure OpenAI 設定！")
+                self._azure_client = AzureOpenAI(azure_endpoint=endpoint, api_key=api_key, api_version=api_version, max_retries=3, timeout=REQUEST_TIMEOUT)
+            return self._azure_client
+
+    # --- 單一供應商呼叫 (同步，於呼叫端執行緒執行) ---
+    def _gemini_request(self, prompt, method, max_output_tokens):
+        api_key = get_setting("GEMINI_API_KEY", "GEMINI_API_KEY")
+        if not api_key:
+            raise MissingCredentialsError("找不到 GEMINI_API_KEY！")
+        url = GEMINI_URL.format(model=GEMINI_MODEL, method=method)
+        data = {"contents": [{"parts": [{"text": prompt}]}], "generationConfig": {"temperature": 0.5, "maxOutputTokens": max_output_tokens}}
+        return url, api_key, data
+
+    def call_gemini(self, prompt, max_output_tokens=4096):
+        import requests
+        url, api_key, data = self._gemini_request(prompt, "generateContent", max_output_tokens)
+        with self._semaphores["gemini"], tracing.span("llm.gemini", prompt_chars=len(prompt)):
+            try:
+                response = self.session.post(url, params={"key": api_key}, json=data, timeout=REQUEST_TIMEOUT)
+                response.raise_for_status()
+                result = response.json()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                raise ModelError(f"呼叫 Gemini API 時發生錯誤: {e}") from e
+        try:
+            return result["candidates"][0]["content"]["parts"][0]["text"]
+        except (KeyError, IndexError, TypeError) as e:
+            raise ModelError("Gemini 沒有回傳內容。") from e
+
+    def call_azure(self, prompt, max_tokens=1024):
+        deployment = get_setting("AZURE_OPENAI_DEPLOYMENT_NAME", "azure_openai", "deployment_name")
+        with self._semaphores["azure"], tracing.span("llm.azure", prompt_chars=len(prompt)):
+            try:
+                response = self.azure_client.chat.completions.create(
+                    model=deployment,
+                    messages=self._azure_messages(prompt),
+                    temperature=0.5, max_tokens=max_tokens,
+                )
+            except ModelError:
+                raise
+            except Exception as e:
+                raise ModelError(f"呼叫 Azure OpenAI API 時發生錯誤: {e}") from e
+        try:
+            return response.choices[0].message.content
+        except (AttributeError, IndexError) as e:
+            raise ModelError("Azure OpenAI 沒有回傳內容。") from e
+
+    def _azure_messages(self, prompt):
+        return [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}]
+
+    # --- 串流呼叫 (產生器，於呼叫端執行緒逐段產生文字) ---
+    def stream_gemini(self, prompt, max_output_tokens=4096):
+        import requests
+        url, api_key, data = self._gemini_request(prompt, "streamGenerateContent", max_output_tokens)
+        received = False
+        with self._semaphores["gemini"], tracing.span("llm.gemini.stream", prompt_chars=len(prompt)):
+            try:
+                with self.session.post(url, params={"key": api_key, "alt": "sse"}, json=data, timeout=REQUEST_TIMEOUT, stream=True) as response:
+                    response.raise_for_status()
+                    response.encoding = "utf-8"
+                    for line in response.iter_lines(decode_unicode=True):
+                        if not line or not line.startswith("data:"):
+                            continue
+                        candidates = json.loads(line[5:]).get("candidates") or [{}]
+                        for part in (candidates[0].get("content") or {}).get("parts", []):
+                            if part.get("text"):
+                                received = True
+                                yield part["text"]
+            except (requests.exceptions.RequestException, ValueError) as e:
+                raise ModelError(f"呼叫 Gemini API 時發生錯誤: {e}") from e
+        if not received:
+            raise ModelError("Gemini 沒有回傳內容。")
+
+    def stream_azure(self, prompt, max_tokens=1024):
+        deployment = get_setting("AZURE_OPENAI_DEPLOYMENT_NAME", "azure_openai", "deployment_name")
+        with self._semaphores["azure"], tracing.span("llm.azure.stream", prompt_chars=len(prompt)):
+            try:
+                response = self.azure_client.chat.completions.create(model=deployment, messages=self._azure_messages(prompt), temperature=0.5, max_tokens=max_tokens, stream=True)
+                for chunk in response:
+                    # Azure 的第一個 chunk 可能只有內容過濾結果，沒有 choices
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            except ModelError:
+                raise
+            except Exception as e:
+                raise ModelError(f"呼叫 Azure OpenAI API 時發生錯誤: {e}") from e
+
+    def stream(self, model, prompt):
+        if PROVIDERS.get(model) == "gemini":
+            return self.stream_gemini(prompt)
+        if PROVIDERS.get(model) == "azure":
+            return self.stream_azure(prompt)
+        raise ModelError(f"未知的模型: {model}")
+
+    def call(self, model, prompt):
+        if PROVIDERS.get(model) == "gemini":
+            return self.call_gemini(prompt)
+        if PROVIDERS.get(model) == "azure":
+            return self.call_azure(prompt)
+        raise ModelError(f"未知的模型: {model}")
+
+    # --- 非同步與競速 ---
+    def submit(self, model, prompt):
+        # 帶著呼叫端的 context，工作執行緒中的 span 才會記到同一次腳本執行的 Trace
+        return self._executor.submit(copy_context().run, self.call, model, prompt)
+
+    def race(self, prompt, parse, models=(MODEL_GEMINI, MODEL_AZURE), timeout=REQUEST_TIMEOUT * 2):
+        """同時詢問多個模型，回傳第一個能通過 parse 的 (模型名稱, 原始回覆, 解析結果)。
+
+        全部失敗時拋出 ModelError，訊息包含每個模型的失敗原因；任一模型拋出非預期的例外也只算該模型失敗。
+        """
+        futures = {self.submit(model, prompt): model for model in models}
+        errors = []
+        try:
+            for future in as_completed(futures, timeout=timeout):
+                model = futures[future]
+                try:
+                    text = future.result()
+                    return model, text, parse(text)
+                except Exception as e:
+                    errors.append(f"{model}: {e}")
+        except TimeoutError:
+            errors.append("等待模型回覆逾時")
+        finally:
+            for future in futures:
+                future.cancel()
+        raise ModelError("；".join(errors))
@@ -0,0 +1,109 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+# --- 蒙地卡羅模擬引擎 (不依賴 Streamlit) ---
+# 只追蹤每條路徑的對數報酬累加值，不保留整個 (天數 × 路徑) 矩陣；
+# 路徑分批處理，記憶體用量只與 chunk_size 有關，與總路徑數無關。
+
+TRADING_DAYS = 252
+DEFAULT_CHUNK_SIZE = 5000
+DEFAULT_SEED = 42
+METHODS = ("normal", "lognormal", "bootstrap", "block_bootstrap")
+_CACHE_SIZE = 32
+
+
+@dataclass(frozen=True)
+class SimulationResult:
+    final_values: np.ndarray
+    n_paths: int
+    years: int
+    initial_investment: float
+    method: str
+
+    def percentiles(self, q=(5, 50, 95)):
+        return np.percentile(self.final_values, q)
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def simulate_final_values(returns, n_paths=1000, years=10, initial_investment=10000, method="normal", block_size=20, seed=DEFAULT_SEED, chunk_size=DEFAULT_CHUNK_SIZE):
+    """模擬 initial_investment 在 years 年後的終值分佈。
+
+    method:
+      - "normal": 與原本相同，每日報酬取自 N(平均, 標準差)，逐日累積
+      - "lognormal": 以日對數報酬的平均與變異數直接抽出終值，速度與天數無關
+      - "bootstrap": 從歷史日報酬中重抽樣
+      - "block_bootstrap": 以連續 block_size 天為單位重抽樣，保留波動聚集
+    seed 為 None 時每次結果不同，也不會寫入快取。
+    """
+    if method not in METHODS:
+        raise ValueError(f"未知的模擬方法: {method}")
+    returns = np.asarray(returns, dtype="float64")
+    returns = returns[~np.isnan(returns)]
+    key = None
+    if seed is not None:
+        key = (method, int(n_paths), int(years), float(initial_investment), int(block_size), int(seed), _returns_key(returns, method))
+        with _cache_lock:
+            if key in _cache:
+                _cache.move_to_end(key)
+                return _cache[key]
+
+    rng = np.random.default_rng(seed)
+    steps = TRADING_DAYS * years
+    log_returns = np.log1p(returns)
+    log_totals = np.empty(n_paths)
+    for begin in range(0, n_paths, chunk_size):
+        size = min(chunk_size, n_paths - begin)
+        log_totals[begin:begin + size] = _simulate_chunk(rng, method, returns, log_returns, steps, size, block_size)
+    result = SimulationResult(initial_investment * np.exp(log_totals), n_paths, years, initial_investment, method)
+
+    if key is not None:
+        with _cache_lock:
+            _cache[key] = result
+            if len(_cache) > _CACHE_SIZE:
+                _cache.popitem(last=False)
+    return result
+
+
+def _simulate_chunk(rng, method, returns, log_returns, steps, size, block_size):
+    if method == "lognormal":
+        return rng.normal(log_returns.mean() * steps, log_returns.std(ddof=1) * np.sqrt(steps), size)
+
+    if method == "block_bootstrap":
+        # 以前綴和取得任一區塊的對數報酬總和，每條路徑只需抽 steps / block_size 次。
+        # 環狀區塊 (尾端接回開頭)：每一天被抽中的機率相同，序列頭尾的日子不會被低估而讓漂移偏向中段
+        n = len(log_returns)
+        block_size = max(1, min(block_size, n))
+        prefix = np.concatenate(([0.0], np.cumsum(np.concatenate([log_returns, log_returns[:block_size - 1]]))))
+        n_blocks, remainder = divmod(steps, block_size)
+        starts = rng.integers(0, n, (n_blocks, size))
+        totals = (prefix[starts + block_size] - prefix[starts]).sum(axis=0)
+        if remainder:
+            starts = rng.integers(0, n, size)
+            totals += prefix[starts + remainder] - prefix[starts]
+        return totals
+
+    # 逐年抽樣，一次只保留 (252 × size) 的亂數
+    mean, std = returns.mean(), returns.std(ddof=1)
+    totals = np.zeros(size)
+    for done in range(0, steps, TRADING_DAYS):
+        days = min(TRADING_DAYS, steps - done)
+        if method == "bootstrap":
+            totals += log_returns[rng.integers(0, len(log_returns), (days, size))].sum(axis=0)
+        else:
+            totals += np.log1p(rng.normal(mean, std, (days, size))).sum(axis=0)
+    return totals
+
+
+def _returns_key(returns, method):
+    if method in ("bootstrap", "block_bootstrap"):
+        return hashlib.sha1(returns.tobytes()).hexdigest()
+    if method == "lognormal":
+        returns = np.log1p(returns)
+    return (len(returns), float(returns.mean()), float(returns.std(ddof=1)))
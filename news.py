@@ -0,0 +1,183 @@
+import hashlib
+import threading
+import time
+from concurrent.futures import Future
+from contextvars import copy_context
+from itertools import chain, zip_longest
+
+import tracing
+from cache_backend import Cache, MemoryBackend
+
+# --- 財經新聞與 AI 摘要 ---
+# 新聞以「單一代碼」為單位快取，不同投資組合共用；摘要以排序後的代碼組合與
+# 實際使用的文章為鍵，文章沒變就不重新呼叫 AI。背景執行緒定期為近期有人瀏覽的
+# 投資組合更新新聞與摘要，儀表板大多只需讀取已算好的結果；剛產生的新建議則以 prefetch
+# 立即在背景產生摘要，不必等到第一次瀏覽。
+
+NO_NEWS_MESSAGE = "今天沒有您投資組合的相關重大新聞。"
+SUMMARY_FAILED_MESSAGE = "AI 無法總結新聞，請稍後再試。"
+# 摘要過了 summary_ttl 仍保留一段時間，文章沒變時可以直接沿用而不必重新呼叫 AI
+SUMMARY_RETENTION = 24 * 3600
+
+
+def normalize_tickers(tickers):
+    return tuple(sorted({t.strip().upper() for t in tickers if t and t.strip()}))
+
+
+def build_summary_prompt(tickers, articles):
+    news_content = ""
+    for article in articles:
+        news_content += f"Title: {article['title']}\nDescription: {article['description']}\n\n"
+    return f"請扮演一位專業的財經分析師，用繁體中文為一位投資新手，總結以下關於他們投資組合 ({', '.join(tickers)}) 的市場新聞。請識別潛在的正面或負面訊號，並以客觀、精簡的風格分析可能帶來的影響。請將最終總結控制在 200 字以內，並直接給出結論。\n\n新聞原文如下：\n{news_content}"
+
+
+class NewsPipeline:
+    def __init__(self, fetch_articles, summarize, article_ttl=3600, summary_ttl=3600, max_articles=5, active_window=24 * 3600, article_cache=None, summary_cache=None):
+        """fetch_articles(ticker) 回傳 NewsAPI 格式的文章列表；summarize(prompt) 回傳摘要文字。
+
+        article_cache、summary_cache 為 cache_backend.Cache，未指定時使用行程內的 LRU。
+        """
+        self._fetch_articles = fetch_articles
+        self._summarize = summarize
+        self.article_ttl = article_ttl
+        self.summary_ttl = summary_ttl
+        self.max_articles = max_articles
+        self.active_window = active_window
+        self._lock = threading.Lock()
+        self._articles = article_cache if article_cache is not None else Cache("news_articles", MemoryBackend(), article_ttl)
+        self._summaries = summary_cache if summary_cache is not None else Cache("news_summaries", MemoryBackend(), SUMMARY_RETENTION)
+        self._active = {}
+        self._pending = {}
+        self._prefetcher = None
+        self._stop = threading.Event()
+
+    # --- 新聞 ---
+    def articles_for(self, tickers):
+        """回傳投資組合的去重新聞；只為快取過期或缺少的代碼呼叫 NewsAPI。"""
+        tickers = normalize_tickers(tickers)
+        now = time.time()
+        entries = {t: self._articles.get(t) for t in tickers}
+        for ticker, entry in entries.items():
+            if not self._fresh(entry, now):
+                entries[ticker] = self._refresh_articles(ticker)
+        per_ticker = [entries[t][1] for t in tickers]
+        # 依各代碼的相關度輪流挑選，避免單一熱門代碼佔滿名額
+        merged, seen = [], set()
+        for article in chain.from_iterable(zip_longest(*per_ticker)):
+            if article is None:
+                continue
+            fingerprint = article.get('url') or article.get('title')
+            if fingerprint in seen:
+                continue
+            seen.add(fingerprint)
+            merged.append(article)
+            if len(merged) >= self.max_articles:
+                break
+        return merged
+
+    def _fresh(self, entry, now):
+        return entry is not None and now - entry[0] < self.article_ttl
+
+    def _refresh_articles(self, ticker):
+        with tracing.span("newsapi.fetch", ticker=ticker):
+            articles = self._fetch_articles(ticker) or []
+        entry = (time.time(), articles)
+        self._articles.set(ticker, entry, self.article_ttl)
+        return entry
+
+    # --- 摘要 ---
+    def cached_summary(self, tickers):
+        """只讀取已算好的摘要，沒有時回傳 None，不會觸發任何網路請求。"""
+        entry = self._summaries.get(normalize_tickers(tickers))
+        return entry[2] if entry and time.time() - entry[0] < self.summary_ttl else None
+
+    def get_summary(self, tickers, refresh=False):
+        tickers = normalize_tickers(tickers)
+        if not refresh:
+            # 背景更新不算瀏覽，避免不再有人看的組合永遠留在預取名單
+            self.register(tickers)
+            summary = self.cached_summary(tickers)
+            if summary is not None:
+                return summary
+            with self._lock:
+                pending = self._pending.get(tickers)
+            if pending is not None:
+                # 背景已在產生同一組合的摘要，等待結果而不重複呼叫 AI；失敗時再自行產生
+                try:
+                    return pending.result()
+                except Exception:
+                    pass
+        articles = self.articles_for(tickers)
+        if not articles:
+            return NO_NEWS_MESSAGE
+        digest = hashlib.sha1("\n".join(a.get('url') or a.get('title') or "" for a in articles).encode("utf-8")).hexdigest()
+        entry = self._summaries.get(tickers)
+        if entry and entry[1] == digest:
+            # 文章沒有變動，沿用原本的摘要並延長有效期
+            self._summaries.set(tickers, (time.time(), digest, entry[2]))
+            return entry[2]
+        summary = self._summarize(build_summary_prompt(tickers, articles))
+        if not summary:
+            return SUMMARY_FAILED_MESSAGE
+        self._summaries.set(tickers, (time.time(), digest, summary))
+        return summary
+
+    # --- 背景預取 ---
+    def register(self, tickers):
+        with self._lock:
+            self._active[normalize_tickers(tickers)] = time.time()
+
+    def prefetch(self, tickers):
+        """在背景產生投資組合的摘要 (例如新建議剛儲存時)，並加入預取名單；回傳 Future。"""
+        tickers = normalize_tickers(tickers)
+        self.register(tickers)
+        with self._lock:
+            if tickers in self._pending:
+                return self._pending[tickers]
+            future = self._pending[tickers] = Future()
+        def run():
+            try:
+                future.set_result(self.get_summary(tickers, refresh=True))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._pending.pop(tickers, None)
+        threading.Thread(target=copy_context().run, args=(run,), name="news-summary-prefetch", daemon=True).start()
+        return future
+
+    def prefetch_once(self):
+        """為近期瀏覽過的投資組合更新新聞與摘要，回傳處理的組合數。"""
+        now = time.time()
+        with self._lock:
+            self._active = {k: seen for k, seen in self._active.items() if now - seen < self.active_window}
+            portfolios = list(self._active)
+        active_tickers = set(chain.from_iterable(portfolios))
+        # 每個代碼只抓一次新聞，並略過半個 article_ttl 內才抓過的代碼 (包括其他副本或頁面剛更新的)，
+        # 每次預取最多為每個代碼呼叫一次 NewsAPI；再為各組合更新摘要 (文章沒變的組合不會重新呼叫 AI)
+        for ticker in sorted(active_tickers):
+            try:
+                if not self._fresh(self._articles.get(ticker), now + self.article_ttl / 2):
+                    self._refresh_articles(ticker)
+            except Exception:
+                continue
+        for tickers in portfolios:
+            try:
+                self.get_summary(tickers, refresh=True)
+            except Exception:
+                continue
+        return len(portfolios)
+
+    def start_prefetcher(self, interval):
+        """每 interval 秒預取一次；間隔短於 article_ttl 時不會抓到新的文章，因此至少為 article_ttl。"""
+        if self._prefetcher is not None:
+            return
+        interval = max(interval, self.article_ttl)
+        def run():
+            while not self._stop.wait(interval):
+                self.prefetch_once()
+        self._prefetcher = threading.Thread(target=run, name="news-prefetcher", daemon=True)
+        self._prefetcher.start()
+
+    def stop_prefetcher(self):
+        self._stop.set()
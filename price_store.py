@@ -0,0 +1,185 @@
+import os
+import json
+import threading
+from contextlib import ExitStack
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+import tracing
+from market_data import RateLimitedError, download_closes
+
+# --- 本地價格資料庫 ---
+# 每個代碼一個 Parquet 檔 (單欄 Close，索引為交易日)，另以 _meta.json 記錄
+# 已涵蓋的起始日與上次向 Yahoo 查詢的時間，只下載尚未儲存的日期區間。
+
+# 環境變數在建立 PriceStore 時才讀取，import 之後才執行的 load_dotenv() 也會生效
+DEFAULT_STORE_DIR = ".price_store"
+DEFAULT_REFRESH_MINUTES = 15
+_META_FILE = "_meta.json"
+
+
+def _to_day(value):
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is not None:
+        ts = ts.tz_localize(None)
+    return ts.normalize()
+
+
+def _exclusive_end(value):
+    # 與 yf.download 相同：日期視為不含當日，帶時間的 datetime (如 datetime.now()) 則包含當日
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is not None:
+        ts = ts.tz_localize(None)
+    day = ts.normalize()
+    return day if ts == day else day + timedelta(days=1)
+
+
+def default_refresh_interval():
+    return timedelta(minutes=int(os.getenv("PRICE_STORE_REFRESH_MINUTES", DEFAULT_REFRESH_MINUTES)))
+
+
+class PriceStore:
+    def __init__(self, root=None, refresh_interval=None, downloader=download_closes):
+        self.root = root or os.getenv("PRICE_STORE_DIR", DEFAULT_STORE_DIR)
+        self.refresh_interval = refresh_interval if refresh_interval is not None else default_refresh_interval()
+        self._download = downloader
+        self._lock = threading.Lock()
+        self._meta_lock = threading.Lock()
+        self._ticker_locks = {}
+        self._series = {}
+        os.makedirs(self.root, exist_ok=True)
+        self._meta = self._load_meta()
+
+    # --- 對外 API ---
+    def get_closes(self, tickers, start, end):
+        """回傳 [start, end) 區間內各代碼對齊後的收盤價，欄位順序與 tickers 相同。"""
+        tickers = list(dict.fromkeys(tickers))
+        start, end = _to_day(start), _exclusive_end(end)
+        with ExitStack() as stack, tracing.span("price_store.update", tickers=len(tickers)):
+            # 只鎖住這次用到的代碼 (依名稱排序避免死結)，不同 session 查詢不同代碼時可同時下載
+            for lock in self._locks_for(tickers):
+                stack.enter_context(lock)
+            self._update(tickers, start, end)
+            columns = {t: self._get_series(t) for t in tickers}
+        data = pd.DataFrame(columns, columns=tickers)
+        data = data[(data.index >= start) & (data.index < end)]
+        return data.dropna(how="all")
+
+    def _locks_for(self, tickers):
+        with self._lock:
+            return [self._ticker_locks.setdefault(t, threading.Lock()) for t in sorted(set(tickers))]
+
+    # --- 增量更新 ---
+    def _update(self, tickers, start, end):
+        now = datetime.now()
+        missing, extend, forward = [], {}, {}
+        for ticker in tickers:
+            meta = self._meta.get(ticker)
+            if meta is None:
+                missing.append(ticker)
+                continue
+            if start < pd.Timestamp(meta["covered_from"]):
+                extend[ticker] = pd.Timestamp(meta["covered_from"])
+            series = self._get_series(ticker)
+            last_bar = series.index[-1] if not series.empty else pd.Timestamp(meta["covered_from"])
+            if end > last_bar and now - datetime.fromisoformat(meta["checked_at"]) >= self.refresh_interval:
+                # 從倒數第二根 K 棒開始抓，用重疊的那天檢查還原權值是否變動 (配息/分割)；
+                # 最後一根可能是盤中價格，不拿來比對
+                forward[ticker] = series.index[-2] if len(series) > 1 else last_bar
+
+        if missing:
+            self._fetch_and_merge(missing, start, end, now)
+        if extend:
+            # 只往前補抓 start 到原本涵蓋起點之間的資料
+            self._fetch_and_merge(list(extend), start, max(extend.values()) + timedelta(days=1), now)
+        if forward:
+            try:
+                fetched = self._fetch(list(forward), min(forward.values()), end)
+            except RateLimitedError:
+                # 已有資料，只是無法更新到最新一天：先用本地資料，下次再試
+                fetched = None
+            if fetched is None:
+                return
+            readjusted = []
+            for ticker, overlap_day in forward.items():
+                old = self._get_series(ticker)
+                new = fetched[ticker].dropna() if ticker in fetched.columns else pd.Series(dtype="float64")
+                if overlap_day in old.index and overlap_day in new.index and abs(new[overlap_day] - old[overlap_day]) > 1e-6 * abs(old[overlap_day]):
+                    readjusted.append(ticker)
+                else:
+                    self._merge(ticker, new, pd.Timestamp(self._meta[ticker]["covered_from"]), now)
+            if readjusted:
+                covered_from = min(pd.Timestamp(self._meta[t]["covered_from"]) for t in readjusted)
+                self._fetch_and_merge(readjusted, covered_from, end, now)
+            self._save_meta()
+
+    def _fetch(self, tickers, start, end):
+        try:
+            with tracing.span("yfinance.download", tickers=len(tickers)):
+                fetched = self._download(tickers, start, end)
+        except RateLimitedError:
+            # 限流與「沒有資料」不同，交給呼叫端顯示對應的訊息；meta 不更新，下次再試
+            raise
+        except Exception:
+            # 下載失敗時不更新 meta，下次呼叫會再試一次
+            return None
+        if not fetched.empty and getattr(fetched.index, "tz", None) is not None:
+            fetched.index = fetched.index.tz_localize(None)
+        return fetched
+
+    def _fetch_and_merge(self, tickers, start, end, now):
+        fetched = self._fetch(tickers, start, end)
+        if fetched is None:
+            return
+        for ticker in tickers:
+            new = fetched[ticker].dropna() if ticker in fetched.columns else pd.Series(dtype="float64")
+            covered_from = min(start, pd.Timestamp(self._meta.get(ticker, {}).get("covered_from", start)))
+            self._merge(ticker, new, covered_from, now)
+        self._save_meta()
+
+    def _merge(self, ticker, new, covered_from, now):
+        old = self._get_series(ticker)
+        series = new.combine_first(old) if not old.empty else new
+        if not new.empty:
+            self._save_series(ticker, series.sort_index().astype("float64"))
+        with self._meta_lock:
+            self._meta[ticker] = {"covered_from": covered_from.strftime("%Y-%m-%d"), "checked_at": now.isoformat()}
+
+    # --- 檔案讀寫 ---
+    def _path(self, ticker):
+        return os.path.join(self.root, f"{ticker.replace('/', '_')}.parquet")
+
+    def _get_series(self, ticker):
+        if ticker not in self._series:
+            path = self._path(ticker)
+            if os.path.exists(path):
+                self._series[ticker] = pd.read_parquet(path)["Close"]
+            else:
+                self._series[ticker] = pd.Series(dtype="float64", index=pd.DatetimeIndex([]))
+        return self._series[ticker]
+
+    def _save_series(self, ticker, series):
+        series.index.name = "Date"
+        path = self._path(ticker)
+        tmp_path = f"{path}.tmp"
+        series.to_frame(name="Close").to_parquet(tmp_path)
+        os.replace(tmp_path, path)
+        self._series[ticker] = series
+
+    def _load_meta(self):
+        path = os.path.join(self.root, _META_FILE)
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_meta(self):
+        path = os.path.join(self.root, _META_FILE)
+        tmp_path = f"{path}.tmp"
+        with self._meta_lock, open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._meta, f)
+        os.replace(tmp_path, path)
@@ -0,0 +1,48 @@
+# --- 投資建議提示詞與回覆格式 ---
+# 模型須以 [START] ... [END] 區塊回覆，區塊內依序為推薦理由、股票代碼、投資比例三行。
+
+SYSTEM_PROMPT = "You are a professional financial advisor."
+
+
+def build_recommendation_prompt(profession, monthly_salary, debt, age_range, risk_tolerance, investment_experience):
+    return f"使用者資料:\n- 職業: {profession}, - 月薪範圍: {monthly_salary} (台幣), - 負債範圍: {debt} (台幣)\n- 年齡範圍: {age_range}, - 風險偏好: {risk_tolerance}, - 投資經驗: {investment_experience}\n\n請根據以上資料，為一位投資新手推薦3到5個美國市場的投資標的（股票或ETF），並嚴格按照以下格式回覆:\n[START]\n推薦理由: [繁體中文，不超過150字]\n股票代碼: [例如：VOO,AAPL,MSFT]\n投資比例: [例如：0.6,0.2,0.2]\n[END]"
+
+
+def parse_recommendation(response_content):
+    """解析模型回覆，回傳 {"reason", "tickers", "weights"}；格式不符時拋出 ValueError。"""
+    try:
+        content = response_content.split("[START]")[1].split("[END]")[0].strip()
+        lines = [line.strip() for line in content.split('\n') if line.strip()]
+        reason = lines[0].replace("推薦理由: ", "")
+        tickers = [t.strip() for t in lines[1].replace("股票代碼: ", "").split(",")]
+        weights = [float(w) for w in lines[2].replace("投資比例: ", "").split(",")]
+    except (AttributeError, IndexError, ValueError) as e:
+        raise ValueError(f"無法解析 AI 回覆格式: {e}") from e
+    if not tickers or len(tickers) != len(weights):
+        raise ValueError("股票代碼與投資比例數量不一致")
+    return {"reason": reason, "tickers": tickers, "weights": weights}
+
+
+class RecommendationStream:
+    """逐段接收串流回覆：reason 為目前已收到的推薦理由，讀到 [END] 時立即解析出 result。"""
+
+    def __init__(self):
+        self.text = ""
+        self.result = None
+
+    def feed(self, chunk):
+        """加入一段文字，回傳解析結果 (區塊尚未結束時為 None)；格式不符時拋出 ValueError。"""
+        self.text += chunk
+        if self.result is None and "[END]" in self.text.partition("[START]")[2]:
+            self.result = parse_recommendation(self.text)
+        return self.result
+
+    @property
+    def reason(self):
+        _, started, body = self.text.partition("[START]")
+        if not started:
+            return ""
+        body = body.split("[END]")[0].split("股票代碼")[0].strip()
+        if "推薦理由:".startswith(body):
+            return ""
+        return body.removeprefix("推薦理由:").strip()
@@ -0,0 +1,95 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from analytics import RISK_FREE_RATE, TRADING_DAYS
+
+# --- 權重試算與再平衡 (不依賴 Streamlit) ---
+# 同一組代碼的所有候選權重一次計算：日報酬只算一次年化平均與共變異數矩陣，
+# 候選權重矩陣 W (候選 × 代碼) 的期望報酬為 W @ mu，變異數為 rowsum((W @ cov) * W)，
+# 一萬組以上的候選也只需幾次矩陣乘法。
+
+DEFAULT_CANDIDATES = 10000
+DEFAULT_SEED = 7
+
+
+@dataclass(frozen=True)
+class WhatIfResult:
+    tickers: tuple
+    weights: np.ndarray
+    expected_returns: np.ndarray
+    volatilities: np.ndarray
+    sharpe_ratios: np.ndarray
+    frontier: np.ndarray
+    min_variance: int
+    max_sharpe: int
+    target: int = 0
+
+    def point(self, i):
+        """第 i 組候選的 {"weights": Series, "expected_return", "volatility", "sharpe_ratio"}。"""
+        return {
+            "weights": pd.Series(self.weights[i], index=list(self.tickers)),
+            "expected_return": float(self.expected_returns[i]), "volatility": float(self.volatilities[i]), "sharpe_ratio": float(self.sharpe_ratios[i]),
+        }
+
+
+def asset_statistics(prices):
+    """由價格 (或標準化價格) 計算年化平均報酬向量與共變異數矩陣；只使用所有代碼都有資料的日期。"""
+    returns = prices.ffill().pct_change(fill_method=None).dropna(how="any")
+    if len(returns) < 2:
+        raise ValueError("歷史資料不足，無法估計報酬與共變異數。")
+    return returns.mean().to_numpy() * TRADING_DAYS, returns.cov().to_numpy() * TRADING_DAYS
+
+
+def candidate_weights(n_assets, n_candidates=DEFAULT_CANDIDATES, seed=DEFAULT_SEED, include=()):
+    """回傳 (候選 × 代碼) 的權重矩陣：include 中的權重排在最前，接著是等權重、單一持股與單純形上的均勻抽樣。"""
+    fixed = [np.asarray(w, dtype=float) / np.sum(w) for w in include]
+    fixed += [np.full(n_assets, 1 / n_assets)] + list(np.eye(n_assets))
+    n_random = max(n_candidates - len(fixed), 0)
+    # Dirichlet(1, ..., 1) 即為總和為 1 的非負權重上的均勻分佈
+    random = np.random.default_rng(seed).dirichlet(np.ones(n_assets), size=n_random)
+    return np.vstack([np.vstack(fixed), random])
+
+
+def evaluate_weights(weights, mu, cov, risk_free_rate=RISK_FREE_RATE):
+    """一次計算所有候選的 (期望年化報酬, 年化波動, 夏普比率)。"""
+    expected_returns = weights @ mu
+    volatilities = np.sqrt(np.maximum(np.einsum("ij,ij->i", weights @ cov, weights), 0.0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sharpe_ratios = np.where(volatilities > 0, (expected_returns - risk_free_rate) / volatilities, np.nan)
+    return expected_returns, volatilities, sharpe_ratios
+
+
+def frontier_indices(expected_returns, volatilities):
+    """效率前緣上的候選索引 (依波動由低到高)：沒有任何波動更低的候選報酬比它高。"""
+    order = np.lexsort((-expected_returns, volatilities))
+    sorted_returns = expected_returns[order]
+    best_before = np.concatenate([[-np.inf], np.maximum.accumulate(sorted_returns)[:-1]])
+    return order[sorted_returns > best_before]
+
+
+def what_if(prices, tickers, target_weights, n_candidates=DEFAULT_CANDIDATES, seed=DEFAULT_SEED, risk_free_rate=RISK_FREE_RATE):
+    """評估 tickers 的大量候選權重，第 0 組為 target_weights (目前建議)。"""
+    tickers = list(tickers)
+    mu, cov = asset_statistics(prices[tickers])
+    weights = candidate_weights(len(tickers), n_candidates, seed, include=[target_weights])
+    expected_returns, volatilities, sharpe_ratios = evaluate_weights(weights, mu, cov, risk_free_rate)
+    return WhatIfResult(
+        tickers=tuple(tickers), weights=weights, expected_returns=expected_returns, volatilities=volatilities, sharpe_ratios=sharpe_ratios,
+        frontier=frontier_indices(expected_returns, volatilities),
+        min_variance=int(np.argmin(volatilities)), max_sharpe=int(np.nanargmax(sharpe_ratios)),
+    )
+
+
+def drift(tickers, target_weights, current_values):
+    """目前配置與目標權重的偏離，以及回到目標需要買進 (正) 或賣出 (負) 的金額。"""
+    target = pd.Series(target_weights, index=list(tickers), dtype=float)
+    target = target / target.sum()
+    current = pd.Series(current_values, dtype=float).reindex(target.index).fillna(0.0)
+    total = current.sum()
+    current_weights = current / total if total else current
+    return pd.DataFrame({
+        "target_weight": target, "current_weight": current_weights, "drift": current_weights - target,
+        "current_value": current, "trade_value": target * total - current,
+    })
@@ -0,0 +1,106 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from cache_backend import Cache
+from prompts import build_recommendation_prompt, parse_recommendation
+
+# --- AI 建議快取 ---
+# 問卷只有選單欄位，相同的 (使用者條件, 模型) 直接回傳先前解析好的建議。
+# 建議本身存放在共用快取後端 (cache_backend.default_backend，依 CACHE_BACKEND 設定) 的 recommendations 命名空間，
+# 網頁、預熱工作與 bulk.py 因此讀寫同一份資料；超過 TTL 的項目視為失效，容量由後端統一控管。
+# 另外在 SQLite 記錄每組條件被查詢的次數，供預熱工作挑出最常見的條件預先產生建議。
+
+PROFILE_FIELDS = ("profession", "monthly_salary", "debt", "age_range", "risk_tolerance", "investment_experience")
+# 環境變數在建立 RecommendationCache 時才讀取，命令列工具在 main() 裡呼叫 load_dotenv() 也會生效
+DEFAULT_PATH = ".recommendation_cache.sqlite"
+DEFAULT_TTL_HOURS = 168
+
+
+def normalize_profile(profile):
+    return tuple(str(profile[field]).strip() for field in PROFILE_FIELDS)
+
+
+def _key(profile, model):
+    return json.dumps([model, *normalize_profile(profile)], ensure_ascii=False)
+
+
+class RecommendationCache:
+    def __init__(self, path=None, ttl=None, entries=None):
+        self.path = path or os.getenv("RECOMMENDATION_CACHE_PATH", DEFAULT_PATH)
+        self.ttl = ttl if ttl is not None else int(os.getenv("RECOMMENDATION_CACHE_TTL_HOURS", DEFAULT_TTL_HOURS)) * 3600
+        self.entries = entries if entries is not None else Cache("recommendations", ttl=self.ttl)
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS requests (key TEXT PRIMARY KEY, model TEXT, profile TEXT, count INTEGER, last_requested REAL)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, profile, model, record_request=True):
+        """回傳快取的建議 {"reason", "tickers", "weights"}，沒有或已過期時回傳 None。"""
+        key = _key(profile, model)
+        if record_request:
+            with self._lock, self._connect() as conn:
+                conn.execute(
+                    "INSERT INTO requests VALUES (?, ?, ?, 1, ?) ON CONFLICT(key) DO UPDATE SET count = count + 1, last_requested = excluded.last_requested",
+                    (key, model, json.dumps(normalize_profile(profile), ensure_ascii=False), time.time()),
+                )
+        return self.entries.get(key)
+
+    def put(self, profile, model, recommendation):
+        self.entries.set(_key(profile, model), {k: recommendation[k] for k in ("reason", "tickers", "weights")})
+
+    def most_requested(self, limit, missing_only=True):
+        """回傳查詢次數最多的 [(profile dict, model), ...]；missing_only 時略過仍有效的快取項目。"""
+        with self._lock, self._connect() as conn:
+            rows = conn.execute("SELECT key, profile, model FROM requests ORDER BY count DESC, last_requested DESC").fetchall()
+        jobs = []
+        for key, profile, model in rows:
+            if len(jobs) >= limit:
+                break
+            if missing_only and self.entries.get(key) is not None:
+                continue
+            jobs.append((dict(zip(PROFILE_FIELDS, json.loads(profile))), model))
+        return jobs
+
+
+def warm_up(cache, gateway, limit=50):
+    """為最常被查詢、但目前沒有有效快取的條件預先產生建議，回傳 (成功數, 失敗數)。"""
+    jobs = cache.most_requested(limit)
+    futures = [(profile, model, gateway.submit(model, build_recommendation_prompt(*normalize_profile(profile)))) for profile, model in jobs]
+    succeeded = failed = 0
+    for profile, model, future in futures:
+        try:
+            cache.put(profile, model, parse_recommendation(future.result()))
+            succeeded += 1
+        except Exception:
+            failed += 1
+    return succeeded, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="預先產生最常見使用者條件的 AI 投資建議")
+    parser.add_argument("--limit", type=int, default=50, help="最多預熱幾組條件")
+    parser.add_argument("--path", help="查詢次數統計檔案位置 (預設為 RECOMMENDATION_CACHE_PATH)")
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+    from model_gateway import ModelGateway
+    load_dotenv()
+    succeeded, failed = warm_up(RecommendationCache(args.path), ModelGateway(), args.limit)
+    print(f"預熱完成：成功 {succeeded} 筆，失敗 {failed} 筆")
+
+
+if __name__ == "__main__":
+    main()
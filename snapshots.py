@@ -0,0 +1,186 @@
+import argparse
+import zlib
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+import analytics
+import tracing
+from cache_backend import Cache, MemoryBackend
+from data_access import BATCH_SIZE, COLLECTION as RECOMMENDATIONS
+
+# --- 推薦績效快照 ---
+# 每晚以命令列執行一次：讀取所有 recommendations 文件，所有代碼合併只下載一次價格，
+# 為每筆推薦寫入 recommendation_snapshots/{推薦文件 ID}：
+#   - value：推薦日到 as_of (含) 的假設投資每日價值 (日期以間隔天數存放，皆以 zlib 壓縮)
+#   - shares：推薦日買進的持股數；last_closes：最後一個交易日的收盤價
+# 推薦日起的買進持有序列不會隨時間移動，「我的投資組合」與再平衡偏離只需取得最後一個交易日起的價格，
+# 比對重疊那天後計算新的幾天即可。快照之後有配息或分割 (還原權值改變) 時改走完整的價格資料。
+# 回測指標的期間每天往後移 (最大回撤、Beta 等無法只用新的一天更新)，仍由 analytics 以價格資料庫計算，不存在快照中。
+
+COLLECTION = "recommendation_snapshots"
+VERSION = 2
+SPLICE_TOLERANCE = 1e-6  # 與 PriceStore 相同
+
+
+def _day(value):
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is not None:
+        ts = ts.tz_convert("UTC").tz_localize(None)
+    return ts.normalize()
+
+
+def _floats(values):
+    return [None if np.isnan(v) else float(v) for v in values]
+
+
+# --- 編碼 ---
+def encode_series(series):
+    days = series.index.values.astype("datetime64[D]").astype(np.int64)
+    return {
+        "start": int(days[0]),
+        "gaps": zlib.compress(np.diff(days).astype(np.uint16).tobytes()),
+        "values": zlib.compress(series.to_numpy(dtype=np.float64).tobytes()),
+    }
+
+
+def decode_series(data):
+    gaps = np.frombuffer(zlib.decompress(data["gaps"]), dtype=np.uint16).astype(np.int64)
+    days = data["start"] + np.concatenate([[0], np.cumsum(gaps)])
+    values = np.frombuffer(zlib.decompress(data["values"]), dtype=np.float64)
+    return pd.Series(values.copy(), index=pd.DatetimeIndex(days.astype("datetime64[D]")))
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    rec_id: str
+    tickers: tuple
+    weights: tuple
+    as_of: pd.Timestamp
+    portfolio_value: pd.Series
+    shares: pd.Series
+    last_closes: pd.Series
+
+    @property
+    def last_day(self):
+        return self.portfolio_value.index[-1]
+
+    def new_prices(self, recent):
+        """回傳 recent 中 last_day 之後的收盤價；recent 必須包含 last_day 那一天，用來確認還原權值沒有變動。
+
+        重疊那天缺少價格或價格不同 (快照之後有配息或分割) 時回傳 None，呼叫端應改用完整的價格資料。
+        """
+        recent = recent.reindex(columns=list(self.tickers))
+        if self.last_day not in recent.index:
+            return None
+        old, new = self.last_closes, recent.loc[self.last_day]
+        known = old.notna()
+        if (new[known].isna() | ((new[known] - old[known]).abs() > SPLICE_TOLERANCE * old[known].abs())).any():
+            return None
+        return recent[recent.index > self.last_day]
+
+
+def build_snapshot(rec, closes, as_of):
+    """由整批收盤價建立一筆推薦的快照文件；資料不足時拋出 ValueError。"""
+    tickers, weights = list(rec["tickers"]), [float(w) for w in rec["weights"]]
+    prices = closes.reindex(columns=tickers)
+    prices = prices[(prices.index >= _day(rec["timestamp"])) & (prices.index <= as_of)].dropna(how="all")
+    if prices.empty:
+        raise ValueError("沒有價格資料")
+    tracking = analytics.track_portfolio(prices, tickers, weights)
+    return {
+        "version": VERSION, "tickers": tickers, "weights": weights, "as_of": as_of.strftime("%Y-%m-%d"),
+        "created_at": datetime.now(timezone.utc), "value": encode_series(tracking.portfolio_value),
+        "shares": _floats(tracking.shares.to_numpy(dtype=float)), "last_closes": _floats(prices.iloc[-1].to_numpy(dtype=float)),
+    }
+
+
+def decode_snapshot(rec_id, doc):
+    if not doc or doc.get("version") != VERSION:
+        return None
+    tickers = list(doc["tickers"])
+    as_float = lambda values: pd.Series([np.nan if v is None else v for v in values], index=tickers, dtype="float64")
+    return Snapshot(
+        rec_id=rec_id, tickers=tuple(tickers), weights=tuple(float(w) for w in doc["weights"]), as_of=pd.Timestamp(doc["as_of"]),
+        portfolio_value=decode_series(doc["value"]), shares=as_float(doc["shares"]), last_closes=as_float(doc["last_closes"]),
+    )
+
+
+# --- 批次產生 ---
+def build_all(db, get_closes, as_of=None, dry_run=False):
+    """為所有推薦寫入快照；get_closes(tickers, start, end) 只會被呼叫一次。回傳 (寫入數, 略過數, 平均大小 bytes)。"""
+    as_of = _day(as_of) if as_of is not None else _day(datetime.now()) - timedelta(days=1)
+    with tracing.span("firestore.query", op="all_recommendations"):
+        recs = [(doc.id, doc.to_dict()) for doc in db.collection(RECOMMENDATIONS).stream()]
+    recs = [(rec_id, rec) for rec_id, rec in recs if rec.get("tickers") and _day(rec["timestamp"]) <= as_of]
+    if not recs:
+        return 0, 0, 0
+    tickers = sorted({t for _, rec in recs for t in rec["tickers"]})
+    start = min(_day(rec["timestamp"]) for _, rec in recs)
+    with tracing.span("snapshots.download", tickers=len(tickers)):
+        closes = get_closes(tickers, start, as_of + timedelta(days=1))
+    written = skipped = total_bytes = 0
+    batch, pending = db.batch(), 0
+    for rec_id, rec in recs:
+        try:
+            doc = build_snapshot(rec, closes, as_of)
+        except (KeyError, ValueError):
+            skipped += 1
+            continue
+        written += 1
+        total_bytes += len(doc["value"]["gaps"]) + len(doc["value"]["values"])
+        if dry_run:
+            continue
+        batch.set(db.collection(COLLECTION).document(rec_id), doc)
+        pending += 1
+        if pending >= BATCH_SIZE:
+            batch.commit()
+            batch, pending = db.batch(), 0
+    if pending:
+        batch.commit()
+    return written, skipped, total_bytes // written if written else 0
+
+
+# --- 讀取 ---
+class SnapshotStore:
+    def __init__(self, db, cache=None):
+        """cache 為 cache_backend.Cache，未指定時使用行程內的 LRU；沒有快照的紀錄也會快取，避免重複讀取。"""
+        self.db = db
+        self.cache = cache if cache is not None else Cache("snapshots", MemoryBackend(), 3600)
+
+    def get_many(self, rec_ids):
+        """回傳 {rec_id: Snapshot}，沒有快照的紀錄不列入。"""
+        found = {}
+        for rec_id in dict.fromkeys(rec_ids):
+            # 鍵包含 VERSION，格式改變後不會讀到舊版的快取物件
+            snapshot = self.cache.get((VERSION, rec_id))
+            if snapshot is None:
+                with tracing.span("firestore.read", op="snapshot"):
+                    doc = self.db.collection(COLLECTION).document(rec_id).get()
+                snapshot = decode_snapshot(rec_id, doc.to_dict() if doc.exists else None) or False
+                self.cache.set((VERSION, rec_id), snapshot)
+            if snapshot:
+                found[rec_id] = snapshot
+        return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="為所有推薦紀錄預先計算績效快照 (建議每晚執行一次)")
+    parser.add_argument("--as-of", help="快照涵蓋到的日期 (YYYY-MM-DD)，預設為昨天")
+    parser.add_argument("--dry-run", action="store_true", help="只計算，不寫入 Firestore")
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+    from data_access import firestore_client
+    from market_data import MarketDataBroker
+    from price_store import PriceStore
+    load_dotenv()
+    store = PriceStore(downloader=MarketDataBroker().download)
+    written, skipped, average_bytes = build_all(firestore_client(), store.get_closes, args.as_of, args.dry_run)
+    print(f"快照完成：{'計算' if args.dry_run else '寫入'} {written} 筆 (平均 {average_bytes:,} bytes)，略過 {skipped} 筆")
+
+
+if __name__ == "__main__":
+    main()
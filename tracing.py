@@ -0,0 +1,196 @@
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- 效能追蹤 ---
+# span() 量測一段外部呼叫或計算階段的耗時，同時記錄到三個地方：
+#   1. 目前這次腳本執行的 Trace，供管理員面板顯示本次 rerun 的耗時分解
+#   2. 行程共用、以 span 名稱分組的直方圖，可由 /metrics 以 Prometheus 格式匯出
+#   3. 結構化日誌：每次執行結束輸出一行 JSON (TRACE_LOG=1 時)
+# 背景執行緒 (例如新聞預取) 沒有 Trace，只會記錄到直方圖。
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+logger = logging.getLogger("robo_advisor.trace")
+
+_current_trace = ContextVar("current_trace", default=None)
+_current_depth = ContextVar("current_depth", default=0)
+
+
+@dataclass
+class Span:
+    name: str
+    tags: dict
+    start: float
+    depth: int
+    duration: float = 0.0
+    error: str = None
+
+
+@dataclass
+class Trace:
+    tags: dict
+    started_at: float = field(default_factory=time.time)
+    started: float = field(default_factory=time.perf_counter)
+    duration: float = None
+    spans: list = field(default_factory=list)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def elapsed(self):
+        return self.duration if self.duration is not None else time.perf_counter() - self.started
+
+    def to_dict(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        return {
+            **self.tags, "started_at": self.started_at, "duration_ms": round(self.elapsed() * 1000, 2),
+            "spans": [{"name": s.name, **s.tags, "start_ms": round(s.start * 1000, 2), "duration_ms": round(s.duration * 1000, 2), "depth": s.depth, **({"error": s.error} if s.error else {})} for s in spans],
+        }
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q):
+        """以桶的上界估計分位數，落在最後一桶時回傳最大桶界。"""
+        with self._lock:
+            if not self.count:
+                return None
+            rank, seen = q * self.count, 0
+            for bound, n in zip(self.buckets, self.counts):
+                seen += n
+                if seen >= rank:
+                    return bound
+            return self.buckets[-1]
+
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def _histogram(name):
+    with _histograms_lock:
+        if name not in _histograms:
+            _histograms[name] = Histogram()
+        return _histograms[name]
+
+
+# --- 追蹤 API ---
+def start_trace(**tags):
+    trace = Trace(tags)
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def finish_trace(trace):
+    trace.duration = time.perf_counter() - trace.started
+    _histogram("script.run").observe(trace.duration)
+    if _current_trace.get() is trace:
+        _current_trace.set(None)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps(trace.to_dict(), ensure_ascii=False, default=str))
+    return trace
+
+
+@contextmanager
+def span(name, **tags):
+    """量測區塊耗時；例外照常拋出，並記錄在 span 的 error 欄位。"""
+    trace, depth = _current_trace.get(), _current_depth.get()
+    started = time.perf_counter()
+    record = Span(name, tags, started - trace.started if trace else 0.0, depth)
+    token = _current_depth.set(depth + 1)
+    try:
+        yield record
+    except BaseException as e:
+        record.error = type(e).__name__
+        raise
+    finally:
+        _current_depth.reset(token)
+        record.duration = time.perf_counter() - started
+        _histogram(name).observe(record.duration)
+        if trace is not None:
+            trace.add(record)
+
+
+# --- 匯出 ---
+def histogram_summary():
+    """回傳 {span 名稱: {"count", "mean", "p50", "p95", "p99"}} (秒)。"""
+    with _histograms_lock:
+        items = sorted(_histograms.items())
+    return {name: {"count": h.count, "mean": h.sum / h.count if h.count else None, "p50": h.quantile(0.5), "p95": h.quantile(0.95), "p99": h.quantile(0.99)} for name, h in items}
+
+
+def render_prometheus():
+    lines = ["# TYPE robo_advisor_span_seconds histogram"]
+    with _histograms_lock:
+        items = sorted(_histograms.items())
+    for name, h in items:
+        with h._lock:
+            counts, total, count = list(h.counts), h.sum, h.count
+        cumulative = 0
+        for bound, n in zip(h.buckets + (float("inf"),), counts):
+            cumulative += n
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'robo_advisor_span_seconds_bucket{{span="{name}",le="{le}"}} {cumulative}')
+        lines.append(f'robo_advisor_span_seconds_sum{{span="{name}"}} {total}')
+        lines.append(f'robo_advisor_span_seconds_count{{span="{name}"}} {count}')
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port):
+    """在背景執行緒提供 http://0.0.0.0:<port>/metrics。"""
+    server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+
+def configure_logging():
+    """TRACE_LOG=1 時每次腳本執行輸出一行 JSON 到 stdout (Cloud Run 會收進 Cloud Logging)。"""
+    if os.getenv("TRACE_LOG") != "1" or logger.handlers:
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False